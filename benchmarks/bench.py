@@ -0,0 +1,151 @@
+"""
+Benchmarks for the driver's hot paths, run against a simulated bus so that no stick or gear is needed.
+
+For each bus size, every benchmark reports the frames it put on the bus, the bus time those frames would take on a real
+DALI bus, and the wall time the driver spent.  Results are written as JSON so that runs can be compared over time.
+
+    python -m benchmarks.bench --sizes 1,8,64 --output bench.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import platform
+import time
+from dali.command import DaliCommand
+from dali.gear import DaliGear
+from dali.simulator import SimulatedBus, FakeHidDevice
+from dali.tridonic import TridonicDali
+
+
+def make_driver(bus):
+    driver = TridonicDali(asyncio.get_running_loop())
+    FakeHidDevice(bus).attach(driver)
+    return driver
+
+
+async def measure(name, size, bus, coro):
+    frames = bus.frames
+    bus_time = bus.bus_time
+    start = time.perf_counter()
+    await coro
+    return {
+        "name": name,
+        "size": size,
+        "frames": bus.frames - frames,
+        "bus_time": bus.bus_time - bus_time,
+        "wall_time": time.perf_counter() - start,
+    }
+
+
+async def bench_commission(size, seed):
+    bus = SimulatedBus.with_gear(size, addressed=False, seed=seed)
+    driver = make_driver(bus)
+    return await measure("commission", size, bus, driver.commission())
+
+
+async def bench_search_for_device(size, seed):
+    bus = SimulatedBus.with_gear(size, addressed=False, seed=seed)
+    for g in bus.gear:
+        g.initialising = True
+    driver = make_driver(bus)
+    return await measure("search_for_device", size, bus, driver.search_for_device())
+
+
+async def bench_scan_for_gear(size, seed):
+    bus = SimulatedBus.with_gear(size, seed=seed)
+    driver = make_driver(bus)
+    return await measure("scan_for_gear", size, bus, driver.scan_for_gear(lookup_product=False))
+
+
+async def bench_fetch_deviceinfo(size, seed):
+    bus = SimulatedBus.with_gear(size, seed=seed)
+    driver = make_driver(bus)
+
+    async def fetch_all():
+        for address in range(size):
+            await DaliGear(driver, address).fetch_deviceinfo(lookup_product=False)
+    return await measure("fetch_deviceinfo", size, bus, fetch_all())
+
+
+async def bench_read_memory(size, seed):
+    bus = SimulatedBus.with_gear(size, seed=seed)
+    driver = make_driver(bus)
+
+    async def read_all():
+        for address in range(size):
+            await driver.read_memory(address, 0, 0, 0x1B)
+    return await measure("read_memory", size, bus, read_all())
+
+
+async def bench_send(count):
+    """Time per frame spent in _send, with replies delivered on the event loop"""
+    bus = SimulatedBus.with_gear(1)
+    driver = make_driver(bus)
+    start = time.perf_counter()
+    for i in range(count):
+        await driver.send_direct_arc_power(0, i % 254 + 1)
+    return (time.perf_counter() - start) / count
+
+
+async def bench_message_received(count):
+    """Time per frame spent in message_received resolving an outstanding command"""
+    driver = TridonicDali(asyncio.get_running_loop())
+    data = bytearray(64)
+    total = 0.0
+    for i in range(count):
+        seq = i % 255 + 1
+        driver.outstanding_commands[seq] = DaliCommand(seq, data, DaliCommand.TYPE_16BIT)
+        start = time.perf_counter()
+        driver.message_received((0x12, 0x72, 0, 0xFE, seq))
+        total += time.perf_counter() - start
+    return total / count
+
+
+BENCHMARKS = [
+    bench_commission,
+    bench_search_for_device,
+    bench_scan_for_gear,
+    bench_fetch_deviceinfo,
+    bench_read_memory,
+]
+
+
+async def run(sizes, count, seed):
+    results = []
+    # The driver prints progress (e.g. addresses assigned during commissioning), which would corrupt the JSON output
+    with contextlib.redirect_stdout(io.StringIO()):
+        for size in sizes:
+            for bench in BENCHMARKS:
+                results.append(await bench(size, seed))
+    return {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "seed": seed,
+        "results": results,
+        "per_frame": {
+            "_send": await bench_send(count),
+            "message_received": await bench_message_received(count),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,2,4,8,16,32,64", help="comma separated list of bus sizes")
+    parser.add_argument("--count", type=int, default=10000, help="frames used by the per frame benchmarks")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the simulated gear's random addresses")
+    parser.add_argument("--output", help="file to write the JSON results to (default stdout)")
+    args = parser.parse_args()
+
+    report = asyncio.run(run([int(s) for s in args.sizes.split(",")], args.count, args.seed))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Soak test: runs concurrent callers against a TridonicDali talking to a simulated bus that injects faults, for a given
+amount of simulated bus time, and checks that the driver stays healthy.
+
+The simulated bus answers instantly, so an hour of bus traffic takes minutes.  At the end the run fails (exit status
+1) if any call hung, any caller got an answer meant for another, DTR0 changed inside a transaction, the in-flight
+table or memory grew beyond its limit, or latency percentiles exceeded their limit.
+
+    python -m benchmarks.soak --hours 1 --callers 8 --output soak.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import sys
+import time
+import tracemalloc
+from dali.command import DaliCommand, DaliException
+from dali.simulator import SimulatedBus, FaultyHidDevice
+from dali.tridonic import TridonicDali
+
+
+# Queries with answers that are the same for every simulated gear and differ from each other, so an answer delivered
+# to the wrong caller can be spotted.
+CHECKED_QUERIES = {
+    DaliCommand.QueryDeviceType: 6,
+    DaliCommand.QueryVersionNumber: 8,
+    DaliCommand.QueryControlGearPresent: 0xFF,
+}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Soak:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.latencies = []
+        self.max_in_flight = 0
+        self.memory = []
+        self.operations = 0
+        self.errors = 0
+        self.hangs = 0
+        self.misattributed = 0
+        self.clobbered = 0
+
+    async def operation(self, driver, address):
+        choice = self.rng.random()
+        if choice < 0.4:
+            cmd = self.rng.choice(list(CHECKED_QUERIES))
+            answer = await driver.send_cmd(address, cmd)
+            if answer is not None and answer != CHECKED_QUERIES[cmd]:
+                self.misattributed += 1
+        elif choice < 0.7:
+            await driver.send_direct_arc_power(address, self.rng.randrange(0, 255))
+        elif choice < 0.8:
+            await driver.send_cmd(address, DaliCommand.QueryActualLevel)
+        elif choice < 0.9:
+            value = self.rng.randrange(0, 16)
+            async with driver.transaction():
+                await driver.send_special_cmd(DaliCommand.SetDTR0, value)
+                dtr0 = await driver.send_cmd(address, DaliCommand.QueryContentDTR0)
+                await driver.send_cmd(address, DaliCommand.SetFadeTime, repeat=2)
+            if dtr0 is not None and dtr0 != value:
+                self.clobbered += 1
+        else:
+            await driver.read_memory(address, 0, 3, 6)
+
+    async def caller(self, driver, bus, gear_count, target):
+        while bus.bus_time < target:
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(self.operation(driver, self.rng.randrange(gear_count)), self.args.timeout)
+            except asyncio.TimeoutError:
+                self.hangs += 1
+            except DaliException:
+                self.errors += 1
+            except Exception:
+                # read_memory raises a plain Exception when a byte goes unanswered
+                self.errors += 1
+            self.latencies.append(time.perf_counter() - start)
+            self.operations += 1
+            self.max_in_flight = max(self.max_in_flight, len(driver.outstanding_commands))
+            if self.operations % self.args.sample_every == 0:
+                self.memory.append(tracemalloc.get_traced_memory()[0])
+                # Keep the latency list itself from growing without bound over a long run
+                if len(self.latencies) > 100000:
+                    self.latencies = self.rng.sample(self.latencies, 50000)
+
+    async def run(self):
+        args = self.args
+        bus = SimulatedBus.with_gear(args.gear, seed=args.seed)
+        device = FaultyHidDevice(bus, no_response=args.no_response, framing_error=args.framing_error,
+                                 reorder=args.reorder, external=args.external, anonymous=args.anonymous,
+                                 seed=args.seed)
+        driver = TridonicDali(asyncio.get_running_loop())
+        driver.report_timeout = args.report_timeout
+        if args.threaded:
+            driver.open(device)
+        else:
+            device.attach(driver)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        target = args.hours * 3600
+        try:
+            await asyncio.gather(*[self.caller(driver, bus, args.gear, target) for i in range(args.callers)])
+        finally:
+            if args.threaded:
+                driver.close()
+        wall = time.perf_counter() - started
+        tracemalloc.stop()
+
+        # Memory is measured from after the first sample, once caches and the like have warmed up
+        growth = self.memory[-1] - self.memory[0] if len(self.memory) > 1 else 0
+        report = {
+            "simulated_hours": bus.bus_time / 3600,
+            "wall_time": wall,
+            "operations": self.operations,
+            "frames": bus.frames,
+            "faults": device.faults,
+            "retry_stats": driver.retry_policy.stats if driver.retry_policy else None,
+            "errors": self.errors,
+            "hangs": self.hangs,
+            "misattributed": self.misattributed,
+            "dtr_clobbered": self.clobbered,
+            "max_in_flight": self.max_in_flight,
+            "in_flight_at_end": len(driver.outstanding_commands),
+            "memory_growth": growth,
+            "latency": {
+                "p50": percentile(self.latencies, 0.5),
+                "p99": percentile(self.latencies, 0.99),
+                "max": max(self.latencies, default=0.0),
+            },
+        }
+        report["failures"] = [
+            message for failed, message in [
+                (self.hangs > 0, "{} calls hung".format(self.hangs)),
+                (self.misattributed > 0, "{} answers went to the wrong caller".format(self.misattributed)),
+                (self.clobbered > 0, "DTR0 was changed inside {} transactions".format(self.clobbered)),
+                (self.max_in_flight > args.max_in_flight,
+                 "in flight table reached {} entries".format(self.max_in_flight)),
+                (len(driver.outstanding_commands) > 0,
+                 "{} commands left in flight".format(len(driver.outstanding_commands))),
+                (growth > args.max_memory_growth, "memory grew by {} bytes".format(growth)),
+                (report["latency"]["p99"] > args.max_p99, "p99 latency {:.3f}s".format(report["latency"]["p99"])),
+            ] if failed
+        ]
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=1.0, help="simulated hours of bus traffic")
+    parser.add_argument("--callers", type=int, default=8, help="concurrent callers")
+    parser.add_argument("--gear", type=int, default=16, help="gear on the simulated bus")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--threaded", action="store_true", help="read reports on the driver's read thread")
+    parser.add_argument("--no-response", type=float, default=0.01, help="rate of lost answers")
+    parser.add_argument("--framing-error", type=float, default=0.01, help="rate of collisions")
+    parser.add_argument("--reorder", type=float, default=0.05, help="rate of delayed reports")
+    parser.add_argument("--external", type=float, default=0.05, help="rate of unsolicited frames")
+    parser.add_argument("--anonymous", type=float, default=0.01, help="rate of no response reports with sequence 0")
+    parser.add_argument("--report-timeout", type=float, default=0.1,
+                        help="seconds the driver waits for the simulated stick to report on earlier commands")
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds before a call counts as hung")
+    parser.add_argument("--sample-every", type=int, default=1000, help="operations between memory samples")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="limit on the in flight table (default callers)")
+    parser.add_argument("--max-memory-growth", type=int, default=1024 * 1024, help="bytes")
+    parser.add_argument("--max-p99", type=float, default=0.5, help="seconds")
+    parser.add_argument("--output", help="file to write the JSON report to (default stdout)")
+    args = parser.parse_args()
+    if args.max_in_flight is None:
+        args.max_in_flight = args.callers
+
+    # The driver prints every unsolicited frame, which would swamp the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = asyncio.run(Soak(args).run())
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    for failure in report["failures"]:
+        print("FAILED: {}".format(failure), file=sys.stderr)
+    sys.exit(1 if report["failures"] else 0)
+
+
+if __name__ == "__main__":
+    main()
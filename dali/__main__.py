@@ -0,0 +1,236 @@
+"""
+Command line tool for a DALI bus connected through a Tridonic USB stick.
+
+    python -m dali scan
+    python -m dali commission --profile
+    python -m dali monitor --duration 60
+    python -m dali dump-memory 3 --bank 0
+    python -m dali set-level all 50%
+
+Add --json for machine readable output, and --profile to report frames sent, bus time, time per phase and Python
+hot spots at the end.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import signal
+import sys
+from .command import DaliCommand
+from .driver import BROADCAST_ADDRESS, group_address
+from .tridonic import TridonicDali
+from .memory import MemoryBankReader
+from .profiling import Profiler
+from .curve import percent_to_arc
+
+
+def parse_address(text):
+    """Parses a short address (0-63), a group (g0-g15) or "all" """
+    if text == "all":
+        return BROADCAST_ADDRESS
+    if text.startswith("g"):
+        group = int(text[1:])
+        if not 0 <= group < 16:
+            raise argparse.ArgumentTypeError("groups are g0 to g15")
+        return group_address(group)
+    address = int(text)
+    if not 0 <= address < 64:
+        raise argparse.ArgumentTypeError("short addresses are 0 to 63")
+    return address
+
+
+def parse_level(text):
+    """Parses an arc power level (0-254) or a percentage (e.g. 50%)"""
+    if text.endswith("%"):
+        return percent_to_arc(float(text[:-1]))
+    level = int(text)
+    if not 0 <= level <= 254:
+        raise argparse.ArgumentTypeError("levels are 0 to 254")
+    return level
+
+
+def gear_to_dict(gear):
+    info = gear.info
+    return {
+        "address": gear.address,
+        "device_type": gear.device_type.code if gear.device_type else None,
+        "level": gear.level,
+        "groups": gear.groups,
+        "min_level": gear.min_level,
+        "max_level": gear.max_level,
+        "unique_id": info.unique_id if info else None,
+        "gtin": info.gtin if info else None,
+        "serial": info.serial if info else None,
+        "firmware_version": info.firmware_version if info else None,
+        "hardware_version": info.hardware_version if info else None,
+        "product": gear.dalidb_record.product_name if gear.dalidb_record else None,
+    }
+
+
+async def scan(driver, args, profiler):
+    with profiler.phase("scan"):
+        devices = await driver.scan_for_gear(lookup_product=not args.no_lookup)
+    return [gear_to_dict(g) for g in devices]
+
+
+async def commission(driver, args, profiler):
+    with profiler.phase("commission"):
+        assigned = await driver.commission()
+    return [{"search_address": search, "address": address} for search, address in assigned.items()]
+
+
+async def monitor(driver, args, profiler):
+    """The driver prints frames it didn't send itself as they arrive.  For JSON output they are collected instead"""
+    frames = []
+
+    class Monitor:
+        def record_sent(self, data):
+            pass
+
+        def record_received(self, message):
+            (dr, ty, ad, cm, sn) = message
+            frames.append({
+                "direction": driver.message_directions.get(dr, dr),
+                "type": driver.message_types.get(ty, ty),
+                "address": ad,
+                "command": DaliCommand.cmd_names.get(cm, cm),
+                "seq": sn,
+            })
+
+    if args.json:
+        profiler.next = Monitor()
+    with profiler.phase("monitor"):
+        try:
+            await asyncio.sleep(args.duration if args.duration else 1e9)
+        except asyncio.CancelledError:
+            pass
+    return frames
+
+
+async def dump_memory(driver, args, profiler):
+    reader = MemoryBankReader(driver)
+    with profiler.phase("dump-memory"):
+        if args.length is None:
+            data = (await reader.read_banks([args.address], args.bank, verify=not args.no_verify))[args.address]
+            offset = 0
+        else:
+            data = await reader.read(args.address, args.bank, args.offset, args.length)
+            offset = args.offset
+    if data is None:
+        return None
+    unanswered = sorted(l for l in reader.unanswered.get((args.address, args.bank), ()) if l >= offset)
+    if not args.json:
+        for row in range(0, len(data), 16):
+            print("{:02x}: {}".format(offset + row, " ".join(
+                "--" if offset + row + i in unanswered else "{:02x}".format(b)
+                for i, b in enumerate(data[row:row + 16]))))
+    return {"address": args.address, "bank": args.bank, "offset": offset, "data": data.hex(), "unanswered": unanswered}
+
+
+async def set_level(driver, args, profiler):
+    with profiler.phase("set-level"):
+        await driver.send_direct_arc_power(args.address, args.level)
+    return {"address": args.address, "level": args.level}
+
+
+COMMANDS = {
+    "scan": scan,
+    "commission": commission,
+    "monitor": monitor,
+    "dump-memory": dump_memory,
+    "set-level": set_level,
+}
+
+
+def print_profile(report):
+    print("Frames sent: {} ({})".format(report["frames"], ", ".join(
+        "{} {}".format(count, kind) for kind, count in sorted(report["frames_by_kind"].items()))), file=sys.stderr)
+    if report["bus_utilisation"] is None:
+        print("Bus time: {:.2f}s estimated for a real bus ({:.2f}s wall time on the simulated one)".format(
+            report["bus_time"], report["wall_time"]), file=sys.stderr)
+    else:
+        print("Bus time: {:.2f}s of {:.2f}s wall time ({:.0%} utilisation)".format(
+            report["bus_time"], report["wall_time"], report["bus_utilisation"]), file=sys.stderr)
+    for name, seconds in report["phases"].items():
+        print("Phase {}: {:.3f}s".format(name, seconds), file=sys.stderr)
+    print("Hot spots:", file=sys.stderr)
+    for spot in report["hot_spots"]:
+        print("  {cumulative_time:8.3f}s {total_time:8.3f}s {calls:8d} {function}".format(**spot), file=sys.stderr)
+
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    driver = TridonicDali(loop)
+    profiler = Profiler(python_profile=args.profile, simulated=args.simulate is not None)
+    with profiler.phase("open"):
+        if args.simulate is not None:
+            from .simulator import SimulatedBus, FakeHidDevice
+            bus = SimulatedBus.with_gear(args.simulate, addressed=args.command != "commission")
+            driver.open(FakeHidDevice(bus))
+        else:
+            driver.open()
+    profiler.attach(driver)
+
+    task = asyncio.current_task()
+    for signame in ('SIGINT', 'SIGTERM'):
+        loop.add_signal_handler(getattr(signal, signame), task.cancel)
+
+    try:
+        # Keep the driver's progress messages out of JSON output
+        with contextlib.redirect_stdout(sys.stderr) if args.json else contextlib.nullcontext():
+            result = await COMMANDS[args.command](driver, args, profiler)
+    finally:
+        with profiler.phase("close"):
+            driver.close()
+
+    output = {"result": result}
+    if args.profile:
+        output["profile"] = profiler.report()
+    if args.json:
+        print(json.dumps(output, indent=2))
+    else:
+        if args.command in ("scan", "commission"):
+            for entry in result:
+                print(entry)
+        if args.profile:
+            print_profile(output["profile"])
+
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--json", action="store_true", help="print results as JSON")
+    common.add_argument("--profile", action="store_true", help="report frames, bus time and hot spots at the end")
+    common.add_argument("--simulate", type=int, metavar="N", help="use a simulated bus with N gear instead of the stick")
+
+    parser = argparse.ArgumentParser(prog="python -m dali", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("scan", parents=[common], help="list the gear on the bus")
+    p.add_argument("--no-lookup", action="store_true", help="don't look products up in the DALI Alliance database")
+
+    commands.add_parser("commission", parents=[common], help="give every gear a new short address")
+
+    p = commands.add_parser("monitor", parents=[common], help="print frames seen on the bus")
+    p.add_argument("--duration", type=float, help="seconds to monitor for (default until interrupted)")
+
+    p = commands.add_parser("dump-memory", parents=[common], help="read a memory bank")
+    p.add_argument("address", type=int, help="short address of the gear")
+    p.add_argument("--bank", type=int, default=0)
+    p.add_argument("--offset", type=int, default=0)
+    p.add_argument("--length", type=int, help="bytes to read (default the whole bank)")
+    p.add_argument("--no-verify", action="store_true", help="don't check the bank checksum")
+
+    p = commands.add_parser("set-level", parents=[common], help="set the arc power level")
+    p.add_argument("address", type=parse_address, help="short address, group (g0-g15) or all")
+    p.add_argument("level", type=parse_level, help="arc power level (0-254) or percentage (e.g. 50%%)")
+
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    except asyncio.CancelledError:
+        pass
+
+
+if __name__ == "__main__":
+    main()
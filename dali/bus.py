@@ -0,0 +1,246 @@
+from array import array
+
+
+# Byte values are held in 16 bit arrays, so that every byte value (0xFF included, e.g. "not in scene" or several device
+# types) can be told apart from a value that hasn't been read.
+UNKNOWN = 0xFFFF
+
+
+def addresses_in(mask):
+    """Yields the addresses of the bits set in a 64 bit address mask, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class DaliBus:
+    """The known state of the (up to 64) gear on one DALI bus.
+
+    State is held in fixed size arrays indexed by short address rather than in an object per gear, with indexes by
+    group, device type and unique ID kept up to date as the state changes.  Group and device type indexes are 64 bit
+    masks of short addresses.  Values that haven't been read yet are UNKNOWN.
+
+    uid_index: dict shared between buses (see Installation), mapping unique ID to (bus, address)
+    """
+
+    def __init__(self, name=None, uid_index=None):
+        self.name = name
+        self.present = 0
+        self.level = array("H", [UNKNOWN]) * 64
+        self.status = array("H", [UNKNOWN]) * 64
+        self.min_level = array("H", [UNKNOWN]) * 64
+        self.max_level = array("H", [UNKNOWN]) * 64
+        self.device_type = array("H", [UNKNOWN]) * 64
+        self.groups = array("H", [0]) * 64
+        self.scenes = array("H", [UNKNOWN]) * (64 * 16)
+        self.unique_ids = [None] * 64
+
+        self.group_index = [0] * 16
+        self.type_index = {}
+        self.uid_index = uid_index if uid_index is not None else {}
+
+    def __len__(self):
+        return bin(self.present).count("1")
+
+    def __iter__(self):
+        for address in addresses_in(self.present):
+            yield GearView(self, address)
+
+    def __contains__(self, address):
+        return bool(self.present & (1 << address))
+
+    def gear(self, address):
+        return GearView(self, address)
+
+    def add(self, address, device_type=None, unique_id=None):
+        self.present |= 1 << address
+        if device_type is not None:
+            self.set_device_type(address, device_type)
+        if unique_id is not None:
+            self.set_unique_id(address, unique_id)
+        return GearView(self, address)
+
+    def remove(self, address):
+        bit = 1 << address
+        self.present &= ~bit
+        self.set_groups(address, 0)
+        self.set_device_type(address, UNKNOWN)
+        self.set_unique_id(address, None)
+        for a in (self.level, self.status, self.min_level, self.max_level):
+            a[address] = UNKNOWN
+        self.scenes[address * 16:address * 16 + 16] = array("H", [UNKNOWN]) * 16
+
+    def set_groups(self, address, groups):
+        bit = 1 << address
+        changed = self.groups[address] ^ groups
+        for group in addresses_in(changed):
+            self.group_index[group] ^= bit
+        self.groups[address] = groups
+
+    def set_device_type(self, address, device_type):
+        bit = 1 << address
+        old = self.device_type[address]
+        if old != UNKNOWN:
+            self.type_index[old] &= ~bit
+            if self.type_index[old] == 0:
+                del self.type_index[old]
+        if device_type != UNKNOWN:
+            self.type_index[device_type] = self.type_index.get(device_type, 0) | bit
+        self.device_type[address] = device_type
+
+    def set_unique_id(self, address, unique_id):
+        old = self.unique_ids[address]
+        if old is not None and self.uid_index.get(old) == (self, address):
+            del self.uid_index[old]
+        if unique_id is not None:
+            self.uid_index[unique_id] = (self, address)
+        self.unique_ids[address] = unique_id
+
+    def in_group(self, group):
+        """Returns a mask of the addresses of gear in group (see addresses_in())"""
+        return self.group_index[group]
+
+    def of_type(self, device_type):
+        """Returns a mask of the addresses of gear of device_type (see addresses_in())"""
+        return self.type_index.get(device_type, 0)
+
+    def find(self, unique_id):
+        found = self.uid_index.get(unique_id)
+        if found is None or found[0] is not self:
+            return None
+        return GearView(self, found[1])
+
+    def snapshot(self):
+        """Returns a copy of the bus state, cheap enough to take on every update"""
+        return {
+            "present": self.present,
+            "level": self.level.tobytes(),
+            "status": self.status.tobytes(),
+            "min_level": self.min_level.tobytes(),
+            "max_level": self.max_level.tobytes(),
+            "device_type": self.device_type.tobytes(),
+            "groups": self.groups.tobytes(),
+            "scenes": self.scenes.tobytes(),
+        }
+
+    def update_from_gear(self, gear):
+        """Records what a DaliGear learned in fetch_deviceinfo()"""
+        if gear.device_type is None:
+            self.remove(gear.address)
+            return
+        view = self.add(gear.address, gear.device_type.code, gear.info.unique_id if gear.info else None)
+        if gear.groups is not None:
+            self.set_groups(gear.address, gear.groups)
+        if gear.level is not None:
+            view.level = gear.level
+        if gear.min_level is not None:
+            view.min_level = gear.min_level
+        if gear.max_level is not None:
+            view.max_level = gear.max_level
+
+
+class GearView:
+    """A lightweight view of one gear's state in a DaliBus"""
+    __slots__ = ("bus", "address")
+
+    def __init__(self, bus, address):
+        self.bus = bus
+        self.address = address
+
+    def _get(self, name):
+        value = getattr(self.bus, name)[self.address]
+        return None if value == UNKNOWN else value
+
+    @property
+    def level(self):
+        return self._get("level")
+
+    @level.setter
+    def level(self, value):
+        self.bus.level[self.address] = UNKNOWN if value is None else value
+
+    @property
+    def status(self):
+        return self._get("status")
+
+    @status.setter
+    def status(self, value):
+        self.bus.status[self.address] = UNKNOWN if value is None else value
+
+    @property
+    def min_level(self):
+        return self._get("min_level")
+
+    @min_level.setter
+    def min_level(self, value):
+        self.bus.min_level[self.address] = UNKNOWN if value is None else value
+
+    @property
+    def max_level(self):
+        return self._get("max_level")
+
+    @max_level.setter
+    def max_level(self, value):
+        self.bus.max_level[self.address] = UNKNOWN if value is None else value
+
+    @property
+    def device_type(self):
+        return self._get("device_type")
+
+    @device_type.setter
+    def device_type(self, value):
+        self.bus.set_device_type(self.address, UNKNOWN if value is None else value)
+
+    @property
+    def groups(self):
+        return self.bus.groups[self.address]
+
+    @groups.setter
+    def groups(self, value):
+        self.bus.set_groups(self.address, value)
+
+    @property
+    def unique_id(self):
+        return self.bus.unique_ids[self.address]
+
+    @unique_id.setter
+    def unique_id(self, value):
+        self.bus.set_unique_id(self.address, value)
+
+    def scene(self, scene):
+        value = self.bus.scenes[self.address * 16 + scene]
+        return None if value == UNKNOWN else value
+
+    def set_scene(self, scene, level):
+        self.bus.scenes[self.address * 16 + scene] = UNKNOWN if level is None else level
+
+    def __eq__(self, other):
+        return isinstance(other, GearView) and other.bus is self.bus and other.address == self.address
+
+    def __hash__(self):
+        return hash((id(self.bus), self.address))
+
+    def __repr__(self):
+        return "GearView({} Lvl {} Type {} Groups {:016b} {})".format(
+            self.address, self.level, self.device_type, self.groups, self.unique_id)
+
+
+class Installation:
+    """Several DALI buses, with a single unique ID index across all of them"""
+
+    def __init__(self):
+        self.buses = []
+        self.uid_index = {}
+
+    def add_bus(self, name=None):
+        bus = DaliBus(name, self.uid_index)
+        self.buses.append(bus)
+        return bus
+
+    def find(self, unique_id):
+        found = self.uid_index.get(unique_id)
+        return None if found is None else GearView(*found)
+
+    def snapshot(self):
+        return [bus.snapshot() for bus in self.buses]
@@ -0,0 +1,159 @@
+import asyncio
+import collections
+from .command import DaliCommand
+from .driver import BROADCAST_ADDRESS, start_detached
+
+
+# Commands that set the output to an absolute level, so that a newer one for the same target makes an older one
+# pointless.  Relative commands (Up, StepDown etc.) depend on what went before, so they are never coalesced.
+LEVEL_COMMANDS = frozenset([
+    DaliCommand.Off,
+    DaliCommand.RecallMaxLevel,
+    DaliCommand.RecallMinLevel,
+    DaliCommand.GoToLastActiveLevel,
+] + [DaliCommand.GoToScene + scene for scene in range(16)])
+
+
+def target(address):
+    """Returns the key used to match commands addressed to the same gear"""
+    if address == BROADCAST_ADDRESS:
+        return ("broadcast",)
+    elif address & 0x40:
+        return ("group", address & 0x0F)
+    return ("short", address)
+
+
+def overlaps(a, b):
+    """Could commands for targets a and b affect the same gear?  Group membership isn't known here, so a group or
+    broadcast command may overlap with anything"""
+    if a[0] == "short" and b[0] == "short":
+        return a == b
+    return True
+
+
+class PendingCommand:
+    __slots__ = ("key", "data", "repeat", "coalescable", "futures")
+
+    def __init__(self, key, data, repeat, coalescable, future):
+        self.key = key
+        self.data = data
+        self.repeat = repeat
+        self.coalescable = coalescable
+        self.futures = [future]
+
+
+class CommandCoalescer:
+    """Sits in front of a driver, queueing commands and sending them one at a time.
+
+    While a level setting command (direct arc power, off, recall, go to scene) is waiting to be sent, a newer level
+    setting command for the same target replaces it in the queue, so the most recent intent is what reaches the bus.
+    Callers of a replaced command get the result of the command that replaced it.  Everything else (queries, relative
+    commands, special commands and anything sent twice) is sent untouched, in order.
+
+    A command is only replaced if no command queued after it could affect the same gear, so that the result on the bus
+    is the same as if every command had been sent.
+
+    Commands from a task in a driver transaction (see DaliDriver.transaction()) are sent straight away, in the caller's
+    task, as the worker would otherwise wait for that transaction to end.
+
+    pause() holds queued commands back (still coalescing them) until a matching resume(), e.g. during a maintenance
+    window (see maintenance.py).
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.queue = collections.deque()
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.paused = 0
+        self.coalesced = 0
+        self.sent = 0
+
+    def start(self):
+        if self.task is None:
+            self.task = start_detached(self.run())
+        return self
+
+    async def close(self):
+        """Stops sending.  Commands that are still queued fail with CancelledError"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        while self.queue:
+            for future in self.queue.popleft().futures:
+                future.cancel()
+
+    def pause(self):
+        self.paused += 1
+
+    def resume(self):
+        self.paused -= 1
+        if not self.paused:
+            self.wakeup.set()
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        await self.close()
+
+    def submit(self, key, data, repeat=1, coalescable=False):
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        if coalescable:
+            for pending in reversed(self.queue):
+                if overlaps(pending.key, key):
+                    if pending.key == key and pending.coalescable:
+                        pending.data = data
+                        pending.futures.append(future)
+                        self.coalesced += 1
+                        return future
+                    break
+        self.queue.append(PendingCommand(key, data, repeat, coalescable, future))
+        self.wakeup.set()
+        return future
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.queue and not self.paused:
+                pending = self.queue.popleft()
+                try:
+                    result = await self.driver._send(pending.data, repeat=pending.repeat)
+                except asyncio.CancelledError:
+                    for future in pending.futures:
+                        future.cancel()
+                    raise
+                except Exception as ex:
+                    for future in pending.futures:
+                        if not future.done():
+                            future.set_exception(ex)
+                else:
+                    for future in pending.futures:
+                        if not future.done():
+                            future.set_result(result)
+                self.sent += 1
+
+    async def send(self, key, data, repeat=1, coalescable=False):
+        if self.driver.in_transaction():
+            return await self.driver._send(data, repeat=repeat)
+        return await self.submit(key, data, repeat, coalescable)
+
+    async def send_direct_arc_power(self, address: int, level):
+        # 0xFF (MASK) means "no change" and stops a running fade, so it is not treated as a level
+        return await self.send(target(address), (address << 9) | level, coalescable=level != 0xFF)
+
+    async def send_cmd(self, address: int, cmd: int, repeat=1):
+        return await self.send(target(address), (address << 9) | (0x01 << 8) | cmd, repeat,
+                               coalescable=repeat == 1 and cmd in LEVEL_COMMANDS)
+
+    async def send_special_cmd(self, special_cmd: int, param: int = 0, repeat=1):
+        return await self.send(("broadcast",), (special_cmd << 8) | param, repeat)
+
+    async def broadcast(self, cmd, repeat=1):
+        return await self.send_cmd(BROADCAST_ADDRESS, cmd, repeat)
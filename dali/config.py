@@ -0,0 +1,167 @@
+from .command import DaliCommand
+from .driver import BROADCAST_ADDRESS, group_address
+from typing import NamedTuple, Optional, Dict, Iterable
+
+
+class GearSettings(NamedTuple):
+    """Configuration held in a gear.  A setting of None is unknown (when read) or left alone (when desired)"""
+    power_on_level: Optional[int] = None
+    system_failure_level: Optional[int] = None
+    min_level: Optional[int] = None
+    max_level: Optional[int] = None
+    fade_time: Optional[int] = None
+    fade_rate: Optional[int] = None
+
+
+# The configuration command that stores DTR0 into each setting
+SET_COMMANDS = {
+    "power_on_level": DaliCommand.SetPowerOnLevel,
+    "system_failure_level": DaliCommand.SetSystemFailureLevel,
+    "min_level": DaliCommand.SetMinLevel,
+    "max_level": DaliCommand.SetMaxLevel,
+    "fade_time": DaliCommand.SetFadeTime,
+    "fade_rate": DaliCommand.SetFadeRate,
+}
+
+
+# The query that reads each setting back (the fade time and rate share one)
+QUERY_COMMANDS = {
+    "power_on_level": DaliCommand.QueryPowerOnLevel,
+    "system_failure_level": DaliCommand.QuerySystemFailureLevel,
+    "min_level": DaliCommand.QueryMinLevel,
+    "max_level": DaliCommand.QueryMaxLevel,
+    "fade_time": DaliCommand.QueryFadeTimeFadeRate,
+    "fade_rate": DaliCommand.QueryFadeTimeFadeRate,
+}
+
+
+async def read_setting(driver, address, setting) -> Optional[int]:
+    answer = await driver.send_cmd(address, QUERY_COMMANDS[setting])
+    if answer is None or QUERY_COMMANDS[setting] != DaliCommand.QueryFadeTimeFadeRate:
+        return answer
+    return answer >> 4 if setting == "fade_time" else answer & 0x0F
+
+
+async def read_settings(driver, address) -> GearSettings:
+    fade = await driver.send_cmd(address, DaliCommand.QueryFadeTimeFadeRate)
+    return GearSettings(
+        power_on_level = await driver.send_cmd(address, DaliCommand.QueryPowerOnLevel),
+        system_failure_level = await driver.send_cmd(address, DaliCommand.QuerySystemFailureLevel),
+        min_level = await driver.send_cmd(address, DaliCommand.QueryMinLevel),
+        max_level = await driver.send_cmd(address, DaliCommand.QueryMaxLevel),
+        fade_time = None if fade is None else fade >> 4,
+        fade_rate = None if fade is None else fade & 0x0F,
+    )
+
+
+class ConfigTransaction:
+    """Applies settings to many gear at once, sending as few frames as it can.
+
+    Only settings that differ from the gear's current values are written.  When every gear on the bus (or in a group)
+    either needs a value or already has it, the value is written with one broadcast (or group) command instead of one
+    per gear.  Writes are ordered by value, so that all the writes needing the same DTR0 share a single SetDTR0, and are
+    sent in one driver transaction so that nobody else can change DTR0 in between.
+
+    current: the known settings of gear (address -> GearSettings).  Where a setting is to be written to a single gear
+             and its current value isn't known, it is read from the gear when the transaction is committed.  Settings
+             written with a broadcast or group command are never read, as the write costs the same either way.
+    groups: group membership (group -> set of addresses), if known, so that group commands can be used
+    all_gear: the addresses of every gear on the bus, if known, so that broadcast commands can be used
+    """
+
+    def __init__(self, driver, current: Dict[int, GearSettings] = None, groups: Dict[int, Iterable[int]] = None,
+                 all_gear: Iterable[int] = None):
+        self.driver = driver
+        self.current = dict(current or {})
+        self.all_gear = frozenset(all_gear) if all_gear is not None else None
+        self.groups = {g: frozenset(members) for g, members in (groups or {}).items()}
+        self.desired = {}
+
+    def set(self, addresses, **settings):
+        """Sets the desired settings (keyword arguments named after GearSettings fields) for one or more gear"""
+        if isinstance(addresses, int):
+            addresses = [addresses]
+        for address in addresses:
+            self.desired[address] = self.desired.get(address, GearSettings())._replace(**settings)
+        return self
+
+    async def fetch_missing(self):
+        """Reads the unknown current values of settings that the plan writes to single gear"""
+        for (value, setting, target, covered) in self.plan():
+            if target >= 64:
+                continue  # Broadcast or group
+            known = self.current.get(target, GearSettings())
+            if getattr(known, setting) is None:
+                self.current[target] = known._replace(**{setting: await read_setting(self.driver, target, setting)})
+
+    def satisfied(self, address, setting, value):
+        """True if writing value for setting to this gear would be harmless, because it needs it or already has it"""
+        desired = self.desired.get(address)
+        if desired is not None and getattr(desired, setting) is not None:
+            return getattr(desired, setting) == value
+        known = self.current.get(address)
+        return known is not None and getattr(known, setting) == value
+
+    def plan(self):
+        """Returns the writes to make, as a list of (dtr0, setting, target address, covered addresses), in send order"""
+        needed = {}
+        for address, desired in self.desired.items():
+            known = self.current.get(address, GearSettings())
+            for setting, value in desired._asdict().items():
+                if value is not None and getattr(known, setting) != value:
+                    needed.setdefault((setting, value), set()).add(address)
+
+        writes = []
+        for (setting, value), addresses in needed.items():
+            if self.all_gear and all(self.satisfied(a, setting, value) for a in self.all_gear):
+                writes.append((value, setting, BROADCAST_ADDRESS, self.all_gear))
+                continue
+
+            remaining = set(addresses)
+            usable = [(g, members) for g, members in self.groups.items()
+                      if all(self.satisfied(a, setting, value) for a in members)]
+            while True:
+                best = max(usable, key=lambda u: len(u[1] & remaining), default=None)
+                if best is None or len(best[1] & remaining) < 2:
+                    break
+                writes.append((value, setting, group_address(best[0]), best[1]))
+                remaining -= best[1]
+            for address in sorted(remaining):
+                writes.append((value, setting, address, frozenset([address])))
+
+        # Gear clamps its minimum to its current maximum, so a minimum that is being raised above the current maximum has
+        # to wait until after the maximum has been written.  Where the current maximum isn't known, the minimum waits
+        # for any maximum being written.
+        writes_max = any(setting == "max_level" for (value, setting, target, covered) in writes)
+
+        def deferred(write):
+            (value, setting, target, covered) = write
+            if setting != "min_level":
+                return False
+            for a in covered:
+                max_level = self.current.get(a, GearSettings()).max_level
+                if value > max_level if max_level is not None else writes_max:
+                    return True
+            return False
+
+        writes.sort(key=lambda w: (deferred(w), w[0]))
+        return writes
+
+    async def commit(self):
+        """Sends the changes, returning the number of frames sent"""
+        await self.fetch_missing()
+        frames = 0
+        dtr0 = None
+        async with self.driver.transaction():
+            for (value, setting, target, covered) in self.plan():
+                if value != dtr0:
+                    await self.driver.send_special_cmd(DaliCommand.SetDTR0, value)
+                    dtr0 = value
+                    frames += 1
+                # Configuration commands must be received twice within 100ms, so let the stick repeat it.
+                await self.driver.send_cmd(target, SET_COMMANDS[setting], repeat=2)
+                frames += 2
+                for address in covered:
+                    self.current[address] = self.current.get(address, GearSettings())._replace(**{setting: value})
+        self.desired = {}
+        return frames
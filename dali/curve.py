@@ -0,0 +1,120 @@
+"""
+The DALI logarithmic dimming curve and fade timings (IEC 62386-102), as precomputed tables.
+
+Arc power level n (1-254) gives 10 ^ ((n - 1) / (253 / 3) - 1) percent of full light output, so level 1 is 0.1% and
+level 254 is 100%.  Level 0 is off.
+
+Fades triggered by a direct arc power command take the gear's fade time, and move linearly through arc power levels
+(i.e. logarithmically in light output).  Fade time n (1-15) is 0.5 * sqrt(2 ^ n) seconds, and fade time 0 means no
+fade.  Up and Down commands fade at the fade rate for 200ms, fade rate n (1-15) being 506 / sqrt(2 ^ n) steps a second.
+
+Functions taking a list operate on many gear at once, so shadow state can be kept for large installations without
+querying the gear.
+"""
+import bisect
+import math
+from typing import Sequence, List
+from .gear import Fade
+
+
+ARC_TO_PERCENT = [0.0] + [10 ** ((n - 1) / (253 / 3) - 1) for n in range(1, 255)]
+
+# Half way points between adjacent levels, for converting percentages back to the nearest level
+_PERCENT_BOUNDARIES = [math.sqrt(ARC_TO_PERCENT[n] * ARC_TO_PERCENT[n + 1]) for n in range(1, 254)]
+
+# Percent (in tenths of a percent, 0 to 1000) to arc power level
+PERCENT_TO_ARC = [0] + [bisect.bisect(_PERCENT_BOUNDARIES, p / 10) + 1 for p in range(1, 1001)]
+
+FADE_TIMES = [0.0] + [0.5 * math.sqrt(2 ** n) for n in range(1, 16)]
+FADE_RATES = [0.0] + [506 / math.sqrt(2 ** n) for n in range(1, 16)]
+
+# Up and Down commands fade for this long
+STEP_DURATION = 0.2
+
+
+def arc_to_percent(level: int) -> float:
+    return ARC_TO_PERCENT[level]
+
+
+def percent_to_arc(percent: float) -> int:
+    """Returns the arc power level giving light output closest to percent (which is clamped to 0-100)"""
+    if percent <= 0:
+        return 0
+    if percent >= 100:
+        return 254
+    tenths = percent * 10
+    if tenths == int(tenths):
+        return PERCENT_TO_ARC[int(tenths)]
+    return bisect.bisect(_PERCENT_BOUNDARIES, percent) + 1
+
+
+def arcs_to_percents(levels: Sequence[int]) -> List[float]:
+    table = ARC_TO_PERCENT
+    return [table[level] for level in levels]
+
+
+def percents_to_arcs(percents: Sequence[float]) -> List[int]:
+    return [percent_to_arc(p) for p in percents]
+
+
+def level_at(start: int, target: int, fade: Fade, t: float, min_level: int = 1) -> float:
+    """Predicts the arc power level t seconds after a direct arc power command from start to target.
+
+    Fading up from off starts at min_level, and fading down to off goes to min_level and then switches off.
+    """
+    return levels_at([start], [target], [fade], t, [min_level])[0]
+
+
+def levels_at(starts: Sequence[int], targets: Sequence[int], fades: Sequence[Fade], t, min_levels=None) -> List[float]:
+    """Predicts the arc power level of many gear at once (see level_at()).
+
+    t is either a single time (seconds since the command) for all gear, or a sequence of times, one per gear.
+    min_levels is an optional sequence of each gear's minimum level.
+    """
+    count = len(starts)
+    times = t if hasattr(t, "__len__") else [t] * count
+    mins = min_levels if min_levels is not None else [1] * count
+    fade_times = FADE_TIMES
+    result = []
+    for start, target, fade, elapsed, min_level in zip(starts, targets, fades, times, mins):
+        duration = 0.0 if start == target else fade_times[fade.time]
+        if elapsed >= duration:
+            result.append(float(target))
+        elif elapsed <= 0:
+            result.append(float(start))
+        else:
+            begin = min_level if start == 0 else start
+            end = min_level if target == 0 else target
+            result.append(begin + (end - begin) * elapsed / duration)
+    return result
+
+
+def percents_at(starts: Sequence[int], targets: Sequence[int], fades: Sequence[Fade], t, min_levels=None) -> List[float]:
+    """Like levels_at(), but returns light output in percent.  Levels part way between two steps are interpolated on
+    the logarithmic curve."""
+    result = []
+    for level in levels_at(starts, targets, fades, t, min_levels):
+        if level <= 0:
+            result.append(0.0)
+        else:
+            result.append(10 ** ((level - 1) / (253 / 3) - 1))
+    return result
+
+
+def step_levels(starts: Sequence[int], fades: Sequence[Fade], up: bool, min_levels=None, max_levels=None) -> List[int]:
+    """Predicts the level of many gear after an Up (or Down) command, which fades at the fade rate for 200ms.  Up and
+    Down don't switch gear on or off."""
+    count = len(starts)
+    mins = min_levels if min_levels is not None else [1] * count
+    maxes = max_levels if max_levels is not None else [254] * count
+    result = []
+    for start, fade, min_level, max_level in zip(starts, fades, mins, maxes):
+        if start == 0:
+            result.append(0)
+            continue
+        steps = int(FADE_RATES[fade.rate] * STEP_DURATION)
+        if up:
+            result.append(min(max_level, start + steps))
+        else:
+            result.append(max(min_level, start - steps))
+    return result
@@ -2,6 +2,47 @@ from .gear import DaliGear
 from .command import DaliCommand, DaliException, FramingException
 from typing import List, Awaitable
 import asyncio
+import contextlib
+import contextvars
+
+
+# send_cmd() and send_direct_arc_power() take a short address (0-63), or one of these
+BROADCAST_ADDRESS = 0x7F
+
+
+def group_address(group: int) -> int:
+    return 0x40 | group
+
+
+# Addressed commands that read or depend on the data transfer registers
+DTR_COMMANDS = frozenset([
+    DaliCommand.QueryContentDTR0,
+    DaliCommand.QueryContentDTR1,
+    DaliCommand.QueryContentDTR2,
+    DaliCommand.ReadMemoryLocation,
+])
+
+
+def exclusive_frame(cmd: int, type=DaliCommand.TYPE_16BIT) -> bool:
+    """Returns True for frames that use state shared by everything on the bus, and so must not be interleaved with
+    another caller's transaction: special commands (which set the DTRs or drive initialisation), configuration commands
+    (which read DTR0 and must arrive twice in a row), DTR and memory queries, and application extended commands (which
+    follow an EnableDeviceType).  Arc power levels, level commands and other queries can go out at any time."""
+    if type != DaliCommand.TYPE_16BIT:
+        return False
+    a = (cmd >> 8) & 0xFF
+    b = cmd & 0xFF
+    if 0xA0 <= a <= 0xFD:
+        return True
+    if a & 0x01 == 0:
+        return False
+    return 0x20 <= b <= 0x81 or b in DTR_COMMANDS or b >= 0xE0
+
+
+def start_detached(coro):
+    """Starts a long lived task (e.g. a worker) in a fresh context.  A task otherwise starts in a copy of its creator's
+    context, and so would be taken for part of any transaction its creator was in."""
+    return contextvars.Context().run(asyncio.ensure_future, coro)
 
 
 class ClashException(DaliException):
@@ -40,7 +81,52 @@ class SearchAddressSender:
 
 class DaliDriver:
     def __init__(self) -> None:
-        pass
+        self.transaction_lock = None
+        self.transaction_token = None  # Identifies the transaction in progress
+        self.transactions = 0  # Counts transactions started, so that cached DTR state can tell if it is still valid
+        self.transaction_context = contextvars.ContextVar("dali_transaction_{}".format(id(self)), default=None)
+        self.quiescent = False  # Whether we've put input devices in quiescent mode
+        self.maintenance_windows = 0  # Maintenance windows open (see maintenance.py)
+        self.maintenance_lock = None
+        self.quiescent_refresher = None
+        self.profiler = None  # Optional Profiler (see profiling.py), timing the steps of long operations
+
+    def phase(self, name):
+        """Returns a context manager that times a step of a long operation, if a profiler is attached"""
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.phase(name)
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """Gives the calling task (and any tasks it starts) the bus's shared state, e.g. to set DTR0 and then send the
+        command that uses it.  Exclusive frames (see exclusive_frame()) from other tasks wait until the transaction is
+        over, and other frames carry on as normal.  Transactions nest, so a transaction inside another is part of it.
+
+            async with driver.transaction():
+                await driver.send_special_cmd(DaliCommand.SetDTR0, level)
+                await driver.send_cmd(address, DaliCommand.SetPowerOnLevel, repeat=2)
+        """
+        if self.in_transaction():
+            yield
+            return
+        if self.transaction_lock is None:
+            self.transaction_lock = asyncio.Lock()
+        async with self.transaction_lock:
+            self.transactions += 1
+            self.transaction_token = object()
+            reset = self.transaction_context.set(self.transaction_token)
+            try:
+                yield
+            finally:
+                self.transaction_context.reset(reset)
+                self.transaction_token = None
+
+    def in_transaction(self):
+        """Is the current task in the transaction in progress?  Tasks started within a transaction are part of it, but
+        only until it ends."""
+        token = self.transaction_context.get()
+        return token is not None and token is self.transaction_token
 
     async def _send(self, data: int, type=DaliCommand.TYPE_16BIT, repeat=1):
         raise Exception("Not Implemented")
@@ -60,16 +146,21 @@ class DaliDriver:
 
     async def start_quiescent(self):
         await self._send(0xFFFE1D, type=DaliCommand.TYPE_DA24CONF, repeat=2)
+        self.quiescent = True
 
     async def stop_quiescent(self):
         await self._send(0xFFFE1E, type=DaliCommand.TYPE_DA24CONF, repeat=2)
+        self.quiescent = False
 
 
-    async def scan_for_gear(self) -> Awaitable[List[DaliGear]]:
+    async def scan_for_gear(self, lookup_product=True, bus=None) -> Awaitable[List[DaliGear]]:
+        """Finds all gear with short addresses.  If bus (a DaliBus) is supplied, it is updated with what was found"""
         devices = []
         for address in range(0,64):
             gear = DaliGear(self, address)
-            await gear.fetch_deviceinfo()
+            await gear.fetch_deviceinfo(lookup_product)
+            if bus is not None:
+                bus.update_from_gear(gear)
 
             if gear.device_type:
                 devices.append(gear)
@@ -77,6 +168,16 @@ class DaliDriver:
 
 
 
+    async def confirm_gear(self, addresses) -> List[int]:
+        """Cheaply checks that gear still answers at each of the given addresses, with one query each.
+        Returns the addresses that didn't answer"""
+        missing = []
+        for address in addresses:
+            if await self.send_cmd(address, DaliCommand.QueryControlGearPresent) is None:
+                missing.append(address)
+        return missing
+
+
     async def compare(self, search, address_sender):
         """
         Compares the supplied search value with items on the bus. 
@@ -136,56 +237,66 @@ class DaliDriver:
 
 
     async def commission(self):
+        """Gives every gear on the bus a new short address.  Returns a dict of search address -> short address assigned.
+        Runs in a maintenance window, unless one is already open."""
+        from .maintenance import MaintenanceWindow
+        async with MaintenanceWindow(self):
+            async with self.transaction():
+                return await self._commission()
+
+    async def _commission(self):
         # Terminate any outstanding initialise.
         await self.send_special_cmd(DaliCommand.Terminate, 0)
         try:
-
-            # TODO start quiescent mode (24 bit command.)
-
-            # Put devices in initialisation mode. 
-            await self.send_special_cmd(DaliCommand.Initialise, repeat=2)
+            with self.phase("commission: initialise"):
+                # Put devices in initialisation mode. 
+                await self.send_special_cmd(DaliCommand.Initialise, repeat=2)
 
 
-            # Clear out any existing short addresses
-            await self.send_special_cmd(DaliCommand.SetDTR0, 0xFF)
-            await self.broadcast(DaliCommand.SetShortAddress, repeat=2)
+                # Clear out any existing short addresses
+                await self.send_special_cmd(DaliCommand.SetDTR0, 0xFF)
+                await self.broadcast(DaliCommand.SetShortAddress, repeat=2)
 
-            # Reset operating mode
-            await self.send_special_cmd(DaliCommand.SetDTR0, 128)
-            await self.broadcast(DaliCommand.SetOperatingMode, repeat=2)
+                # Reset operating mode
+                await self.send_special_cmd(DaliCommand.SetDTR0, 128)
+                await self.broadcast(DaliCommand.SetOperatingMode, repeat=2)
 
-            # Remove devices from groups
-            for group in range(16):
-                await self.broadcast(DaliCommand.RemoveFromGroup | group, repeat=2)
+                # Remove devices from groups
+                for group in range(16):
+                    await self.broadcast(DaliCommand.RemoveFromGroup | group, repeat=2)
 
-            # Randomise the search addresses for all devices. 
-            await self.send_special_cmd(DaliCommand.Randomise, repeat=2)
-            await asyncio.sleep(0.1)  
+                # Randomise the search addresses for all devices. 
+                await self.send_special_cmd(DaliCommand.Randomise, repeat=2)
+                await asyncio.sleep(0.1)  
 
             
             finished = False
             search_floor = 0
 
             available_short_addresses = list(range(64))
+            assigned = {}
 
             while not finished:
                 # We know that there are no more devices less than search floor, so pass that in as a starting point.
                 # TODO strictly, we could make this faster, as we know which segments of the search have stuff in and which don't.
                 try:
-                    found = await self.search_for_device(search_floor)
+                    with self.phase("commission: search"):
+                        found = await self.search_for_device(search_floor)
 
-                    if found:
+                    if found is not None:
                         short_addr = available_short_addresses.pop(0)
                         print("Found device at search address {:06x}. Assigning address {}".format(found, short_addr))
                         shifted = (short_addr << 1) | 0x01
-                        await self.send_special_cmd(DaliCommand.ProgramShortAddress, shifted)
-                        queried_short_addr = await self.send_special_cmd(DaliCommand.QueryShortAddress)
-
-                        if queried_short_addr == shifted:
-                            # Good, the device took the address
-                            await self.send_special_cmd(DaliCommand.Withdraw)
-                        else:
-                            raise DaliException("Short Address did not stick (Returned {:02x} instead of {:02x})".format(queried_short_addr, shifted))
+                        with self.phase("commission: program address"):
+                            await self.send_special_cmd(DaliCommand.ProgramShortAddress, shifted)
+                            queried_short_addr = await self.send_special_cmd(DaliCommand.QueryShortAddress)
+
+                            if queried_short_addr == shifted:
+                                # Good, the device took the address
+                                await self.send_special_cmd(DaliCommand.Withdraw)
+                                assigned[found] = short_addr
+                            else:
+                                raise DaliException("Short Address did not stick (Returned {:02x} instead of {:02x})".format(queried_short_addr, shifted))
                         search_floor = found + 1
                     else:
                         # print("No more devices found")
@@ -196,6 +307,7 @@ class DaliDriver:
         finally:
             # Make sure we've terminated our commission process
             await self.send_special_cmd(DaliCommand.Terminate, 0)
+        return assigned
                 
 
 
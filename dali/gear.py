@@ -81,6 +81,18 @@ class GearInfo(NamedTuple):
 
         return "{}-{}".format(self.gtin, self.serial)
 
+    @classmethod
+    def from_memory(cls, buf):
+        """Parses the 20 bytes of memory bank 0 starting at location 0x02"""
+        return cls(
+            last_mem_bank = buf[0],
+            gtin = int.from_bytes(buf[1:7], "big"),
+            firmware_version = "{}.{}".format(buf[7],buf[8]),
+            serial = "{:02x}{:02x}{:02x}{:02x}{:02x}.{:02x}{:02x}{:02x}".format(buf[13],buf[12],buf[11],buf[10],buf[9],buf[16],buf[15],buf[14]),
+            hardware_version = "{}.{}".format(buf[17], buf[18]),
+            dali_version = buf[19]
+        )
+
 
 class DaliGear:
     def __init__(self, driver, address):
@@ -89,12 +101,19 @@ class DaliGear:
         self.device_type = None
         self.info = None
         self.level = None
+        self.groups = None
+        self.min_level = None
+        self.max_level = None
         self.dalidb_record = None
 
     async def _send_cmd(self, cmd):
         return await self.driver.send_cmd(self.address, cmd)
 
-    async def fetch_deviceinfo(self):
+    async def fetch_deviceinfo(self, lookup_product=True):
+        """Queries the gear for its type, identity, groups and limits.
+
+        lookup_product: if set, the product record is looked up in the DALI Alliance database
+        """
         dt = await self.driver.send_cmd(self.address, DaliCommand.QueryDeviceType)
         if dt is None:
             self.device_type = None
@@ -119,23 +138,15 @@ class DaliGear:
             g1 = await self._send_cmd(DaliCommand.QueryGroupsEightToFifteen)
             self.groups = g1 << 8 | g0
 
-            self.min_level = await self._send_cmd(DaliCommand.QueryMaxLevel)
-            self.max_level = await self._send_cmd(DaliCommand.QueryMinLevel)
+            self.min_level = await self._send_cmd(DaliCommand.QueryMinLevel)
+            self.max_level = await self._send_cmd(DaliCommand.QueryMaxLevel)
 
             
-            gtin = int.from_bytes(buf[1:7], "big")
-
-            self.info = GearInfo(
-                last_mem_bank = buf[0],
-                gtin = gtin,
-                firmware_version = "{}.{}".format(buf[7],buf[8]),
-                serial = "{:02x}{:02x}{:02x}{:02x}{:02x}.{:02x}{:02x}{:02x}".format(buf[13],buf[12],buf[11],buf[10],buf[9],buf[16],buf[15],buf[14]),
-                hardware_version = "{}.{}".format(buf[17], buf[18]),
-                dali_version = buf[19]
-            )
+            self.info = GearInfo.from_memory(buf)
 
-            with DaliAllianceProductDB() as db:
-                self.dalidb_record = await db.fetch(gtin)
+            if lookup_product:
+                with DaliAllianceProductDB() as db:
+                    self.dalidb_record = await db.fetch(self.info.gtin)
 
             await self.get_level()            
 
@@ -180,10 +191,10 @@ class DaliGear:
         return await self._send_cmd(DaliCommand.QueryPowerOnLevel)
 
     async def set_power_on_level(self, level):
-        await self.driver.send_special_cmd(DaliCommand.SetDTR0, level)
-        # Command must be sent twice within 100ms.
-        await self._send_cmd(DaliCommand.SetPowerOnLevel)
-        await self._send_cmd(DaliCommand.SetPowerOnLevel)
+        async with self.driver.transaction():
+            await self.driver.send_special_cmd(DaliCommand.SetDTR0, level)
+            # Command must be received twice within 100ms, with nothing in between, so let the stick repeat it.
+            await self.driver.send_cmd(self.address, DaliCommand.SetPowerOnLevel, repeat=2)
 
 
     async def toggle(self):
@@ -195,4 +206,5 @@ class DaliGear:
 
 
     def __repr__(self):
-        return "DaliDevice({} ({}) Lvl {}, {} {} Groups {:016b})".format(self.address, self.device_type, self.level, self.info, self.dalidb_record, self.groups)
+        groups = "?" if self.groups is None else "{:016b}".format(self.groups)
+        return "DaliDevice({} ({}) Lvl {}, {} {} Groups {})".format(self.address, self.device_type, self.level, self.info, self.dalidb_record, groups)
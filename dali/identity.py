@@ -0,0 +1,133 @@
+from .command import DaliCommand
+from .memory import MemoryBankReader, unique_id, BANK0_IDENTITY, BANK0_SERIAL_END
+from typing import NamedTuple, Dict, List, Tuple, Optional
+
+
+# Memory bank 0 locations of the identification number (serial)
+BANK0_SERIAL = 0x0B
+
+# How many bytes of the serial to read when the cheaper queries can't tell gear apart
+SERIAL_BYTES_TO_COMPARE = 4
+
+
+class IdentityFingerprint(NamedTuple):
+    """The cheap to query properties of a gear, used to recognise it again after it has been identified once"""
+    device_type: Optional[int]
+    groups: int
+    random_address: int
+    serial: bytes  # Memory bank 0 locations 0x0B to 0x12
+
+
+class IdentityReport(NamedTuple):
+    addresses: Dict[str, int]  # unique ID -> current short address, for every gear found
+    moved: Dict[str, Tuple[int, int]]  # unique ID -> (old, new) short address, for gear no longer where it was
+    new: List[int]  # Addresses of gear that isn't in the known set
+    missing: List[str]  # Unique IDs of known gear that wasn't found
+
+
+async def query_random_address(driver, address):
+    h = await driver.send_cmd(address, DaliCommand.QueryRandomAddressH)
+    m = await driver.send_cmd(address, DaliCommand.QueryRandomAddressM)
+    l = await driver.send_cmd(address, DaliCommand.QueryRandomAddressL)
+    if h is None or m is None or l is None:
+        return None
+    return h << 16 | m << 8 | l
+
+
+async def query_groups(driver, address):
+    g0 = await driver.send_cmd(address, DaliCommand.QueryGroupsZeroToSeven)
+    g1 = await driver.send_cmd(address, DaliCommand.QueryGroupsEightToFifteen)
+    if g0 is None or g1 is None:
+        return None
+    return g1 << 8 | g0
+
+
+async def survey(driver, addresses, reader=None) -> Dict[str, Tuple[int, IdentityFingerprint]]:
+    """Reads the identity and fingerprint of gear, returning a dict of unique ID -> (address, fingerprint) to keep for
+    verify_identities()"""
+    reader = reader or MemoryBankReader(driver)
+    types = {}
+    for address in addresses:
+        device_type = await driver.send_cmd(address, DaliCommand.QueryDeviceType)
+        if device_type is not None:
+            types[address] = device_type
+    heads = await reader.read_many(list(types), 0, BANK0_IDENTITY, BANK0_SERIAL_END + 1 - BANK0_IDENTITY)
+    known = {}
+    for address, device_type in types.items():
+        known[unique_id(heads[address])] = (address, IdentityFingerprint(
+            device_type = device_type,
+            groups = await query_groups(driver, address),
+            random_address = await query_random_address(driver, address),
+            serial = bytes(heads[address][BANK0_SERIAL - BANK0_IDENTITY:]),
+        ))
+    return known
+
+
+async def verify_identities(driver, known: Dict[str, Tuple[int, IdentityFingerprint]], reader=None,
+                            probe_unknown=True) -> IdentityReport:
+    """Works out where known gear is now (e.g. after a power failure or a ballast swap), using the cheapest queries
+    that can tell gear apart.
+
+    Each known address is checked with the device type, then the groups, then the random address, stopping at the first
+    that doesn't match.  Gear that matches all three is still where it was (6 frames).  Other gear found on the bus is
+    matched to known gear by its random address, and failing that by the first bytes of its serial, which are read
+    from all such gear at once.
+
+    known: dict of unique ID -> (address, fingerprint), as returned by survey()
+    probe_unknown: also look for gear at addresses not in known (one query per address)
+    """
+    reader = reader or MemoryBankReader(driver)
+    addresses = {}
+    unconfirmed = {}  # address -> partial fingerprint (device_type, groups, random_address) of gear found there
+
+    by_address = {address: (uid, fp) for uid, (address, fp) in known.items()}
+    for address in range(64):
+        expected = by_address.get(address)
+        if expected is None and not probe_unknown:
+            continue
+        device_type = await driver.send_cmd(address, DaliCommand.QueryDeviceType)
+        if device_type is None:
+            continue
+        groups = random_address = None
+        if expected is not None:
+            (uid, fp) = expected
+            if device_type == fp.device_type:
+                groups = await query_groups(driver, address)
+                if groups == fp.groups:
+                    random_address = await query_random_address(driver, address)
+                    if random_address == fp.random_address:
+                        addresses[uid] = address
+                        continue
+        unconfirmed[address] = (device_type, groups, random_address)
+
+    remaining = {uid: fp for uid, (address, fp) in known.items() if uid not in addresses}
+    by_random = {fp.random_address: uid for uid, fp in remaining.items() if fp.random_address is not None}
+    ambiguous = []
+    for address, (device_type, groups, random_address) in unconfirmed.items():
+        if random_address is None:
+            random_address = await query_random_address(driver, address)
+        uid = by_random.get(random_address) if random_address is not None else None
+        if uid is not None and remaining[uid].device_type == device_type:
+            addresses[uid] = address
+            del remaining[uid]
+            del by_random[random_address]
+        else:
+            ambiguous.append((address, device_type))
+
+    new = []
+    if ambiguous and remaining:
+        # The random address has changed (e.g. the gear has been re-commissioned), so fall back to the serial.
+        serials = await reader.read_many([a for a, t in ambiguous], 0, BANK0_SERIAL, SERIAL_BYTES_TO_COMPARE)
+        for address, device_type in ambiguous:
+            match = [uid for uid, fp in remaining.items()
+                     if fp.device_type == device_type and fp.serial[:SERIAL_BYTES_TO_COMPARE] == serials[address]]
+            if len(match) == 1:
+                addresses[match[0]] = address
+                del remaining[match[0]]
+            else:
+                new.append(address)
+    else:
+        new = [a for a, t in ambiguous]
+
+    moved = {uid: (known[uid][0], address) for uid, address in addresses.items() if known[uid][0] != address}
+    return IdentityReport(addresses, moved, sorted(new), sorted(remaining))
@@ -0,0 +1,100 @@
+import asyncio
+from .driver import start_detached
+from . import timing
+
+
+class MaintenanceWindow:
+    """Puts the bus in quiescent mode for a batch of bulk jobs, such as commissioning, configuration or memory reads.
+
+    Input devices and other application controllers stop sending in quiescent mode, so the jobs don't collide with
+    them and aren't slowed down by retries.  The mode is restarted well before it times out for as long as the window is
+    open.  Interactive commands sent through coalescer (a CommandCoalescer) are held back while the window is open, with
+    level changes coalesced as usual, and are sent once the bus has left quiescent mode.
+
+        async with MaintenanceWindow(driver, coalescer) as window:
+            await window.run(driver.commission, reader.read_banks(range(64), 0))
+
+    Windows on the same driver can overlap or nest: the first to open starts quiescent mode, and the last to close stops
+    it.  If the bus was already quiescent when the first opened, the windows leave it alone.
+
+    refresh_interval: seconds between restarts of quiescent mode
+    concurrency: how many jobs run() runs at once (default all of them)
+    """
+
+    def __init__(self, driver, coalescer=None, refresh_interval=timing.QUIESCENT_TIMEOUT / 2, concurrency=None):
+        self.driver = driver
+        self.coalescer = coalescer
+        self.refresh_interval = refresh_interval
+        self.concurrency = concurrency
+        self.refreshes = 0
+
+    def lock(self):
+        if self.driver.maintenance_lock is None:
+            self.driver.maintenance_lock = asyncio.Lock()
+        return self.driver.maintenance_lock
+
+    async def __aenter__(self):
+        if self.coalescer is not None:
+            self.coalescer.pause()
+        try:
+            async with self.lock():
+                if self.driver.maintenance_windows == 0 and not self.driver.quiescent:
+                    await self.driver.start_quiescent()
+                    self.driver.quiescent_refresher = start_detached(self.refresh())
+                self.driver.maintenance_windows += 1
+        except BaseException:
+            if self.coalescer is not None:
+                self.coalescer.resume()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        try:
+            async with self.lock():
+                self.driver.maintenance_windows -= 1
+                refresher = self.driver.quiescent_refresher
+                if self.driver.maintenance_windows == 0 and refresher is not None:
+                    self.driver.quiescent_refresher = None
+                    refresher.cancel()
+                    try:
+                        await refresher
+                    except asyncio.CancelledError:
+                        pass
+                    except Exception as ex:
+                        print("Quiescent mode refresh failed ({})".format(ex))
+                    await self.driver.stop_quiescent()
+        finally:
+            if self.coalescer is not None:
+                self.coalescer.resume()
+
+    async def refresh(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.driver.start_quiescent()
+                self.refreshes += 1
+            except Exception as ex:
+                # Try again next time round; the mode lasts long enough to miss one.
+                print("Could not restart quiescent mode ({})".format(ex))
+
+    async def run(self, *jobs, return_exceptions=False):
+        """Runs jobs (awaitables, or functions returning one) at the same time, returning their results in order.
+        Every job is run to the end; if any fail, the first failure is then raised, unless return_exceptions is set.
+
+        Frames from jobs are interleaved on the bus, except that jobs using the DTRs or initialisation take turns (see
+        DaliDriver.transaction()).
+        """
+        semaphore = asyncio.Semaphore(self.concurrency) if self.concurrency else None
+
+        async def start(job):
+            if semaphore is None:
+                return await (job() if callable(job) else job)
+            async with semaphore:
+                return await (job() if callable(job) else job)
+
+        results = await asyncio.gather(*[start(job) for job in jobs], return_exceptions=True)
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+        return results
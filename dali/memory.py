@@ -0,0 +1,230 @@
+import asyncio
+import contextlib
+from .command import DaliCommand, DaliException
+from .gear import GearInfo
+
+
+class MemoryChecksumException(DaliException):
+    """Thrown when a memory bank's contents don't match its checksum"""
+
+
+# Memory bank 0 locations (IEC 62386-102)
+BANK0_IDENTITY = 0x02  # Start of the identity (location 0x01 is reserved in DALI-2 gear, and doesn't answer)
+BANK0_SERIAL_END = 0x12  # Last byte of the identification number
+
+# Stands in for the value of a location that didn't answer
+UNANSWERED = 0xFF
+
+# Banks whose location 0x01 holds a checksum of locations 0x02 onwards
+CHECKSUM_BANKS = (0, 1)
+
+# (bank, location) of locations that may not be implemented, and so not answer
+RESERVED_LOCATIONS = frozenset([(0, 0x01)])
+
+
+def unique_id(identity):
+    """Returns the GearInfo.unique_id for the contents of memory bank 0 read from BANK0_IDENTITY to at least 0x12"""
+    return GearInfo.from_memory(bytes(identity[:20]).ljust(20, b"\0")).unique_id
+
+
+def verify_checksum(bank, data):
+    """Checks the checksum in location 0x01 of a bank read from location 0.  The checksum is chosen such that the sum
+    of locations 0x01 to the last accessible location is 0 (mod 256)."""
+    if sum(data[1:]) & 0xFF != 0:
+        raise MemoryChecksumException("Checksum mismatch in memory bank {}".format(bank))
+
+
+class MemoryBankReader:
+    """Reads memory banks from many gear, keeping track of DTR0 and DTR1 to avoid resending them.
+
+    SetDTR0 and SetDTR1 are broadcast to every gear, and ReadMemoryLocation only moves DTR0 on in the gear that was read.
+    So after one SetDTR1 and one SetDTR0, the same range can be read from any number of gear without setting them again,
+    and reads from different gear can run at the same time.
+
+    A reserved location that doesn't answer (e.g. location 0x01 of bank 0 in DALI-2 gear) isn't implemented, and DTR0
+    still moves on past it.  It reads as UNANSWERED, and is recorded in unanswered (a dict of (address, bank) -> set of
+    locations).  Any other location that doesn't answer is read again, or fails the read (see read_location()).
+
+    Reads run in a driver transaction (see DaliDriver.transaction()).  The tracked state is thrown away if another
+    transaction has run since the reader's last one, as it may have set DTR0 or DTR1; call invalidate() if something
+    else might have changed them.
+    """
+
+    def __init__(self, driver, concurrency=4):
+        self.driver = driver
+        self.concurrency = concurrency
+        self.unanswered = {}
+        self.invalidate()
+
+    def invalidate(self):
+        self.dtr1 = None
+        self.dtr0_all = None
+        self.dtr0 = {}
+        self.transaction = None
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self):
+        """Runs the body in a driver transaction, keeping the tracked state only if the previous transaction was the
+        reader's own (or this is part of it)"""
+        async with self.driver.transaction():
+            if self.transaction not in (self.driver.transactions, self.driver.transactions - 1):
+                self.invalidate()
+            try:
+                yield
+            finally:
+                self.transaction = self.driver.transactions
+
+    async def select(self, addresses, bank, offset):
+        """Makes sure DTR1 is bank, and DTR0 is offset in all the given gear"""
+        if self.dtr1 != bank:
+            await self.driver.send_special_cmd(DaliCommand.SetDTR1, bank)
+            self.dtr1 = bank
+        if any(self.dtr0.get(address, self.dtr0_all) != offset for address in addresses):
+            await self.driver.send_special_cmd(DaliCommand.SetDTR0, offset)
+            self.dtr0_all = offset
+            self.dtr0 = {}
+
+    async def read_location(self, address, location):
+        """Reads the selected location from address, returning None if it is reserved and doesn't answer.
+
+        Any other location that doesn't answer is read again if the frame was lost before it reached the gear (DTR0
+        hasn't moved on).  If DTR0 has moved on, the answer was lost (or the location isn't implemented), and as DTR0
+        can't be set back without disturbing reads from other gear, the read fails.
+        """
+        for attempt in range(2):
+            b = await self.driver.send_cmd(address, DaliCommand.ReadMemoryLocation)
+            if b is not None or (self.dtr1, location) in RESERVED_LOCATIONS:
+                return b
+            dtr0 = await self.driver.send_cmd(address, DaliCommand.QueryContentDTR0)
+            if dtr0 != location & 0xFF:
+                break
+        raise DaliException("got no response reading location 0x{:02x} of memory bank {} of gear {}".format(
+            location, self.dtr1, address))
+
+    async def read_selected(self, address, num):
+        """Reads num bytes from address, which must already be selected"""
+        start = self.dtr0.get(address, self.dtr0_all)
+        unanswered = self.unanswered.setdefault((address, self.dtr1), set())
+        buf = bytearray()
+        try:
+            for i in range(num):
+                b = await self.read_location(address, start + i)
+                if b is None:
+                    unanswered.add(start + i)
+                    b = UNANSWERED
+                else:
+                    unanswered.discard(start + i)
+                buf.append(b)
+        finally:
+            # After a failed read the gear's DTR0 isn't known, so it is set again before the next
+            self.dtr0[address] = start + num if len(buf) == num else None
+        return bytes(buf)
+
+    def answered(self, address, bank, location):
+        return location not in self.unanswered.get((address, bank), ())
+
+    async def gather(self, addresses, fn):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited(address):
+            async with semaphore:
+                return await fn(address)
+        results = await asyncio.gather(*[limited(address) for address in addresses])
+        return dict(zip(addresses, results))
+
+    async def read(self, address, bank, offset, num):
+        async with self.exclusive():
+            await self.select([address], bank, offset)
+            return await self.read_selected(address, num)
+
+    async def read_many(self, addresses, bank, offset, num):
+        """Reads the same range from many gear, returning a dict of address -> bytes"""
+        addresses = list(addresses)
+        async with self.exclusive():
+            await self.select(addresses, bank, offset)
+            return await self.gather(addresses, lambda address: self.read_selected(address, num))
+
+    async def read_banks(self, addresses, bank, verify=True):
+        """Reads a whole bank from many gear, returning a dict of address -> bytes (None where the bank isn't implemented)
+
+        verify: check the checksum of banks that have one
+        """
+        addresses = list(addresses)
+
+        async def read_bank(address):
+            last = await self.driver.send_cmd(address, DaliCommand.ReadMemoryLocation)
+            if last is None:
+                # The bank isn't implemented, so DTR0 isn't moved on.
+                return None
+            self.dtr0[address] = 1
+            data = bytes([last]) + await self.read_selected(address, last)
+            if verify and bank in CHECKSUM_BANKS and self.answered(address, bank, 0x01):
+                verify_checksum(bank, data)
+            return data
+        async with self.exclusive():
+            await self.select(addresses, bank, 0)
+            return await self.gather(addresses, read_bank)
+
+
+class MemoryBankCache:
+    """Caches memory banks by the gear's unique ID, so that gear that has been read before costs only the read of its
+    identity.  GearInfo is only parsed out of bank 0 when it is asked for."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.banks = {}
+        self.parsed = {}
+
+    async def read_heads(self, addresses):
+        """Reads bank 0 from location 0 up to the end of the identification number, returning a dict of address -> bytes"""
+        return await self.reader.read_many(addresses, 0, 0, BANK0_SERIAL_END + 1)
+
+    async def identify(self, addresses):
+        """Returns a dict of address -> unique ID, read from bank 0"""
+        identities = await self.reader.read_many(addresses, 0, BANK0_IDENTITY, BANK0_SERIAL_END + 1 - BANK0_IDENTITY)
+        return {address: unique_id(identity) for address, identity in identities.items()}
+
+    async def load(self, addresses, banks=(0,)):
+        """Makes sure the given banks are cached for all the gear, returning a dict of address -> unique ID"""
+        # One transaction, so that the rest of bank 0 can be read from where the heads left DTR0
+        async with self.reader.exclusive():
+            return await self._load(addresses, banks)
+
+    async def _load(self, addresses, banks):
+        heads = await self.read_heads(list(addresses))
+        ids = {address: unique_id(head[BANK0_IDENTITY:]) for address, head in heads.items()}
+
+        if 0 in banks:
+            # The identity is the start of bank 0, and each gear's DTR0 is left just after it, so carry on from there.
+            missing = [address for address, uid in ids.items() if 0 not in self.banks.get(uid, {})]
+
+            async def rest_of_bank0(address):
+                head = heads[address]
+                data = head + await self.reader.read_selected(address, head[0] + 1 - len(head))
+                if self.reader.answered(address, 0, 0x01):
+                    verify_checksum(0, data)
+                return data
+            for address, data in (await self.reader.gather(missing, rest_of_bank0)).items():
+                self.banks.setdefault(ids[address], {})[0] = data
+
+        for bank in banks:
+            if bank == 0:
+                continue
+            missing = [address for address, uid in ids.items() if bank not in self.banks.get(uid, {})]
+            if missing:
+                for address, data in (await self.reader.read_banks(missing, bank)).items():
+                    self.banks.setdefault(ids[address], {})[bank] = data
+        return ids
+
+    def bank(self, unique_id, bank):
+        return self.banks.get(unique_id, {}).get(bank)
+
+    def info(self, unique_id) -> GearInfo:
+        info = self.parsed.get(unique_id)
+        if info is None:
+            bank0 = self.bank(unique_id, 0)
+            if bank0 is None:
+                return None
+            info = GearInfo.from_memory(bank0[2:0x16])
+            self.parsed[unique_id] = info
+        return info
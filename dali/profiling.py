@@ -0,0 +1,94 @@
+import contextlib
+import cProfile
+import pstats
+import time
+from .command import DaliCommand
+from .retry import classify
+from .tridonic import TridonicDali
+from . import timing
+
+
+class Profiler:
+    """Measures what a driver spends its time on: frames sent (by kind), the bus time they take, wall time per phase
+    and, optionally, Python hot spots.
+
+    It attaches to a TridonicDali in the same place as a TraceRecorder (see trace.py), passing frames on to any recorder
+    that was already attached.
+
+    simulated: the driver talks to a simulated bus, which answers far faster than a real one, so bus utilisation (bus
+               time over wall time) means nothing and is reported as None
+    """
+
+    def __init__(self, python_profile=True, simulated=False):
+        self.frames = 0
+        self.kinds = {}
+        self.bus_time = 0.0
+        self.phases = {}
+        self.depth = 0  # Phases in progress
+        self.started = time.perf_counter()
+        self.next = None
+        self.profile = cProfile.Profile() if python_profile else None
+        self.simulated = simulated
+
+    def attach(self, driver):
+        self.next = driver.recorder
+        driver.recorder = self
+        driver.profiler = self  # For the phases of long operations, e.g. commissioning (see DaliDriver.phase())
+        return self
+
+    def record_sent(self, data):
+        type = TridonicDali.wire_types.get(data[3], DaliCommand.TYPE_16BIT)
+        repeat = 2 if data[2] == 0x20 else 1
+        kind = classify(data[5] << 16 | data[6] << 8 | data[7], type, repeat)[0]
+        self.frames += repeat
+        self.kinds[kind] = self.kinds.get(kind, 0) + repeat
+        self.bus_time += timing.frame_time(type, repeat)
+        if self.next is not None:
+            self.next.record_sent(data)
+
+    def record_received(self, message):
+        if message[1] in (0x72, 0x77):
+            # Answered (or several answers collided)
+            low, high = timing.BACKWARD_SETTLING
+            self.bus_time += (low + high) / 2 + timing.BACKWARD
+        if self.next is not None:
+            self.next.record_received(message)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times the body as the named phase.  Phases nest, so a phase's time includes any phases inside it"""
+        start = time.perf_counter()
+        if self.profile is not None and self.depth == 0:
+            self.profile.enable()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            if self.profile is not None and self.depth == 0:
+                self.profile.disable()
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def hot_spots(self, count=15):
+        if self.profile is None:
+            return []
+        stats = pstats.Stats(self.profile)
+        entries = sorted(stats.stats.items(), key=lambda e: e[1][2], reverse=True)[:count]
+        return [{
+            "function": "{}:{}({})".format(*func),
+            "calls": calls,
+            "total_time": total,
+            "cumulative_time": cumulative,
+        } for func, (primitive, calls, total, cumulative, callers) in entries]
+
+    def report(self):
+        wall = time.perf_counter() - self.started
+        return {
+            "frames": self.frames,
+            "frames_by_kind": self.kinds,
+            "bus_time": self.bus_time,
+            "wall_time": wall,
+            "bus_utilisation": None if self.simulated else self.bus_time / wall if wall > 0 else 0.0,
+            "phases": self.phases,
+            "hot_spots": self.hot_spots(),
+        }
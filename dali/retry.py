@@ -0,0 +1,92 @@
+import random
+from .command import DaliCommand
+from .coalesce import LEVEL_COMMANDS
+from . import timing
+
+
+# Special commands where a framing error is an answer (more than one gear replied), not a collision.  Every gear
+# matching the search address answers these.
+MULTI_ANSWER_SPECIAL_COMMANDS = frozenset([
+    DaliCommand.Compare,
+    DaliCommand.QueryShortAddress,
+    DaliCommand.VerifyShortAddress,
+])
+
+# Commands that move DTR0 on in the gear that acts on them.  After a framing error in reply the gear may already have
+# acted, so sending one again would read or write the next location instead.
+DTR0_ADVANCING_COMMANDS = frozenset([DaliCommand.ReadMemoryLocation])
+DTR0_ADVANCING_SPECIAL_COMMANDS = frozenset([
+    DaliCommand.WriteMemoryLocation,
+    DaliCommand.WriteMemoryLocationNoReply,
+])
+
+
+def classify(cmd, type=DaliCommand.TYPE_16BIT, repeat=1):
+    """Returns (kind, repeatable, multi_answer) for a frame
+
+    kind: name used for the frame's statistics
+    repeatable: sending the frame again leaves the bus in the same state as sending it once
+    multi_answer: more than one gear may answer, so a framing error may be a real answer rather than a collision
+    """
+    if type != DaliCommand.TYPE_16BIT:
+        # Frames sent twice (e.g. quiescent mode) are repeated as a pair.  Other 24 bit frames are for input devices,
+        # which this driver knows nothing about.
+        return ("24bit", repeat == 2, False)
+
+    a = (cmd >> 8) & 0xFF
+    b = cmd & 0xFF
+    if a & 0x80 == 0 or a & 0xE0 == 0x80 or a >= 0xFC:
+        single = a & 0x80 == 0
+        if a & 0x01 == 0:
+            return ("arc", True, False)
+        elif 0x20 <= b <= 0x81:
+            # Configuration commands only take effect when received twice within 100ms.  Retrying one of a pair sent
+            # as separate frames would break the pair, so only frames the stick repeats itself are retried.
+            return ("config", repeat == 2, False)
+        elif b >= DaliCommand.QueryStatus:
+            return ("query", b not in DTR0_ADVANCING_COMMANDS, not single)
+        return ("command", b in LEVEL_COMMANDS, False)
+    repeatable = a not in MULTI_ANSWER_SPECIAL_COMMANDS and a not in DTR0_ADVANCING_SPECIAL_COMMANDS
+    return ("special", repeatable, a in MULTI_ANSWER_SPECIAL_COMMANDS)
+
+
+class RetryPolicy:
+    """Decides which frames are retransmitted after a collision, and keeps count of collisions and retries.
+
+    A framing error in reply to a frame that at most one gear can answer means the frame collided with another
+    transmitter (another controller or an input device).  Such frames are sent again if doing so is safe, after a random
+    delay within the DALI settling time window for the policy's priority, plus a random extra delay that grows with each
+    attempt.  Frames where a framing error is a real answer (e.g. Compare, or a query sent to a group) are never retried,
+    and nor are memory reads and writes, which move DTR0 on in the gear even if the answer collides.
+
+    stats: dict of frame kind (see classify()) -> dict of counts of "sent", "collisions", "retries" and "failures"
+    """
+
+    def __init__(self, max_retries=3, priority=3, rng=None):
+        self.max_retries = max_retries
+        self.priority = priority
+        self.rng = rng or random.Random()
+        self.stats = {}
+
+    def count(self, kind, event):
+        counts = self.stats.get(kind)
+        if counts is None:
+            counts = self.stats[kind] = {"sent": 0, "collisions": 0, "retries": 0, "failures": 0}
+        counts[event] += 1
+
+    def should_retry(self, cmd, type, repeat, attempt):
+        """Called after a framing error on attempt (0 for the first transmission).  Returns True to retransmit"""
+        (kind, repeatable, multi_answer) = classify(cmd, type, repeat)
+        if multi_answer:
+            return False
+        self.count(kind, "collisions")
+        if not repeatable or attempt >= self.max_retries:
+            self.count(kind, "failures")
+            return False
+        self.count(kind, "retries")
+        return True
+
+    def backoff(self, attempt):
+        """Returns the time (seconds) to wait before retransmission number attempt (starting at 1)"""
+        low, high = timing.FORWARD_SETTLING[self.priority]
+        return self.rng.uniform(low, high) + self.rng.uniform(0, attempt * timing.FORWARD_16BIT)
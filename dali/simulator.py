@@ -0,0 +1,447 @@
+"""
+A simulated DALI bus, and a stand in for the Tridonic USB HID device that talks to it.
+
+This lets the driver be exercised (benchmarks, soak tests, trying things out) without a DALI stick or any gear.  Only
+the parts of IEC 62386-102 that the driver uses are modelled.
+"""
+import queue
+import random
+import threading
+from .command import DaliCommand
+from .tridonic import TridonicDali
+from . import timing
+
+
+NO_REPLY = None
+FRAMING_ERROR = -1
+
+# Commands 0x20 to 0x81 are configuration commands, which are only actioned if they are received twice.
+CONFIG_COMMANDS = range(0x20, 0x82)
+
+
+class SimulatedGear:
+    def __init__(self, short_address=None, device_type=6, random_address=None, gtin=0x07ee4bb3b889, serial=None,
+                 unanswered=(), rng=None):
+        self.rng = rng or random.Random()
+        self.short_address = short_address
+        self.device_type = device_type
+        self.random_address = random_address if random_address is not None else self.rng.getrandbits(24)
+        self.level = 254
+        self.last_active_level = 254
+        self.min_level = 1
+        self.max_level = 254
+        self.physical_min_level = 1
+        self.power_on_level = 254
+        self.system_failure_level = 254
+        self.fade_time = 0
+        self.fade_rate = 7
+        self.groups = 0
+        self.scenes = [0xFF] * 16
+        self.dtr0 = 0
+        self.dtr1 = 0
+        self.dtr2 = 0
+        self.initialising = False
+        self.withdrawn = False
+        self.unanswered = frozenset(unanswered)  # (bank, location) of memory that isn't implemented, e.g. (0, 1) in DALI-2
+        self.banks = {0: self.build_bank0(gtin, serial if serial is not None else self.rng.getrandbits(64))}
+
+    @staticmethod
+    def build_bank0(gtin, serial):
+        """Builds memory bank 0 (see DaliGear.fetch_deviceinfo for the layout)"""
+        bank = bytearray(0x1B)
+        bank[0x00] = 0x1A  # Last accessible location
+        bank[0x02] = 0x00  # Last accessible memory bank
+        bank[0x03:0x09] = gtin.to_bytes(6, "big")
+        bank[0x09] = 1  # Firmware version
+        bank[0x0A] = 2
+        bank[0x0B:0x13] = serial.to_bytes(8, "little")
+        bank[0x13] = 3  # Hardware version
+        bank[0x14] = 0
+        bank[0x15] = 8  # 101 version
+        bank[0x16] = 8  # 102 version
+        bank[0x17] = 0xFF  # 103 version
+        bank[0x18] = 1  # Logical control devices
+        bank[0x19] = 1  # Logical control gear
+        bank[0x1A] = 0  # Index of this control gear
+        bank[0x01] = (-sum(bank[2:])) & 0xFF  # Checksum
+        return bank
+
+    def status(self):
+        return (
+            (0x04 if self.level > 0 else 0) |
+            (0x40 if self.short_address is None else 0)
+        )
+
+    def set_level(self, level):
+        if level == 0:
+            self.level = 0
+        else:
+            self.level = max(self.min_level, min(self.max_level, level))
+            self.last_active_level = self.level
+
+    def command(self, cmd):
+        """Processes an addressed command, returning the answer (or NO_REPLY)"""
+        if cmd == DaliCommand.Off:
+            self.level = 0
+        elif cmd == DaliCommand.Up or cmd == DaliCommand.OnAndStepUp:
+            if self.level > 0 or cmd == DaliCommand.OnAndStepUp:
+                self.set_level(self.level + 1)
+        elif cmd == DaliCommand.Down or cmd == DaliCommand.StepDown:
+            if self.level > self.min_level:
+                self.set_level(self.level - 1)
+        elif cmd == DaliCommand.StepUp:
+            if self.level > 0:
+                self.set_level(self.level + 1)
+        elif cmd == DaliCommand.RecallMaxLevel:
+            self.set_level(self.max_level)
+        elif cmd == DaliCommand.RecallMinLevel:
+            self.set_level(self.min_level)
+        elif cmd == DaliCommand.StepDownAndOff:
+            self.level = 0 if self.level <= self.min_level else self.level - 1
+        elif cmd == DaliCommand.GoToLastActiveLevel:
+            self.set_level(self.last_active_level)
+        elif DaliCommand.GoToScene <= cmd < DaliCommand.GoToScene + 16:
+            level = self.scenes[cmd & 0x0F]
+            if level != 0xFF:
+                self.set_level(level)
+        elif cmd == DaliCommand.Reset:
+            banks = self.banks
+            self.__init__(self.short_address, self.device_type, self.random_address, rng=self.rng)
+            self.banks = banks
+        elif cmd == DaliCommand.StoreActualLevelInDTR0:
+            self.dtr0 = self.level
+        elif cmd == DaliCommand.SetMaxLevel:
+            self.max_level = max(self.min_level, min(254, self.dtr0))
+        elif cmd == DaliCommand.SetMinLevel:
+            self.min_level = max(self.physical_min_level, min(self.max_level, self.dtr0))
+        elif cmd == DaliCommand.SetSystemFailureLevel:
+            self.system_failure_level = self.dtr0
+        elif cmd == DaliCommand.SetPowerOnLevel:
+            self.power_on_level = self.dtr0
+        elif cmd == DaliCommand.SetFadeTime:
+            self.fade_time = min(self.dtr0, 15)
+        elif cmd == DaliCommand.SetFadeRate:
+            self.fade_rate = max(1, min(self.dtr0, 15))
+        elif DaliCommand.SetScene <= cmd < DaliCommand.SetScene + 16:
+            self.scenes[cmd & 0x0F] = self.dtr0
+        elif DaliCommand.RemoveFromScene <= cmd < DaliCommand.RemoveFromScene + 16:
+            self.scenes[cmd & 0x0F] = 0xFF
+        elif DaliCommand.AddToGroup <= cmd < DaliCommand.AddToGroup + 16:
+            self.groups |= 1 << (cmd & 0x0F)
+        elif DaliCommand.RemoveFromGroup <= cmd < DaliCommand.RemoveFromGroup + 16:
+            self.groups &= ~(1 << (cmd & 0x0F))
+        elif cmd == DaliCommand.SetShortAddress:
+            self.short_address = None if self.dtr0 == 0xFF else (self.dtr0 >> 1) & 0x3F
+        elif cmd == DaliCommand.QueryStatus:
+            return self.status()
+        elif cmd == DaliCommand.QueryControlGearPresent:
+            return 0xFF
+        elif cmd == DaliCommand.QueryLampPowerOn:
+            return 0xFF if self.level > 0 else NO_REPLY
+        elif cmd == DaliCommand.QueryMissingShortAddress:
+            return 0xFF if self.short_address is None else NO_REPLY
+        elif cmd == DaliCommand.QueryVersionNumber:
+            return 8
+        elif cmd == DaliCommand.QueryContentDTR0:
+            return self.dtr0
+        elif cmd == DaliCommand.QueryDeviceType:
+            return self.device_type
+        elif cmd == DaliCommand.QueryPhysicalMinimum:
+            return self.physical_min_level
+        elif cmd == DaliCommand.QueryContentDTR1:
+            return self.dtr1
+        elif cmd == DaliCommand.QueryContentDTR2:
+            return self.dtr2
+        elif cmd == DaliCommand.QueryActualLevel:
+            return self.level
+        elif cmd == DaliCommand.QueryMaxLevel:
+            return self.max_level
+        elif cmd == DaliCommand.QueryMinLevel:
+            return self.min_level
+        elif cmd == DaliCommand.QueryPowerOnLevel:
+            return self.power_on_level
+        elif cmd == DaliCommand.QuerySystemFailureLevel:
+            return self.system_failure_level
+        elif cmd == DaliCommand.QueryFadeTimeFadeRate:
+            return self.fade_time << 4 | self.fade_rate
+        elif DaliCommand.QuerySceneLevel <= cmd < DaliCommand.QuerySceneLevel + 16:
+            return self.scenes[cmd & 0x0F]
+        elif cmd == DaliCommand.QueryGroupsZeroToSeven:
+            return self.groups & 0xFF
+        elif cmd == DaliCommand.QueryGroupsEightToFifteen:
+            return self.groups >> 8
+        elif cmd == DaliCommand.QueryRandomAddressH:
+            return (self.random_address >> 16) & 0xFF
+        elif cmd == DaliCommand.QueryRandomAddressM:
+            return (self.random_address >> 8) & 0xFF
+        elif cmd == DaliCommand.QueryRandomAddressL:
+            return self.random_address & 0xFF
+        elif cmd == DaliCommand.ReadMemoryLocation:
+            bank = self.banks.get(self.dtr1)
+            if bank is None or self.dtr0 > bank[0]:
+                return NO_REPLY
+            value = bank[self.dtr0] if (self.dtr1, self.dtr0) not in self.unanswered else NO_REPLY
+            if self.dtr0 < 0xFF:
+                self.dtr0 += 1
+            return value
+        return NO_REPLY
+
+
+class SimulatedBus:
+    """A DALI bus with some simulated gear on it.
+
+    When more than one gear answers a query the bus reports a framing error, which is what the driver expects to
+    happen with overlapping backward frames.
+    """
+
+    def __init__(self, gear=None):
+        self.gear = list(gear or [])
+        self.search_address = 0xFFFFFF
+        self.last_frame = None
+        self.quiescent = False  # Input devices and other controllers have been told to stay quiet
+        self.frames = 0
+        self.bus_time = 0.0
+
+    @classmethod
+    def with_gear(cls, count, addressed=True, seed=None):
+        rng = random.Random(seed)
+        return cls([SimulatedGear(i if addressed else None, rng=rng) for i in range(count)])
+
+    def addressed(self, a):
+        """Returns the gear addressed by the first byte of a 16 bit forward frame"""
+        if a & 0x80 == 0:
+            short = (a >> 1) & 0x3F
+            return [g for g in self.gear if g.short_address == short]
+        elif a & 0xE0 == 0x80:
+            group = 1 << ((a >> 1) & 0x0F)
+            return [g for g in self.gear if g.groups & group]
+        elif a >= 0xFE:
+            return self.gear
+        elif a >= 0xFC:
+            return [g for g in self.gear if g.short_address is None]
+        return []
+
+    def searched(self):
+        return [g for g in self.gear if g.initialising and g.random_address == self.search_address]
+
+    def special(self, a, b, repeat):
+        if a == DaliCommand.Terminate:
+            for g in self.gear:
+                g.initialising = False
+        elif a == DaliCommand.SetDTR0:
+            for g in self.gear:
+                g.dtr0 = b
+        elif a == DaliCommand.SetDTR1:
+            for g in self.gear:
+                g.dtr1 = b
+        elif a == DaliCommand.SetDTR2:
+            for g in self.gear:
+                g.dtr2 = b
+        elif a == DaliCommand.Initialise:
+            if repeat == 2:
+                for g in self.gear:
+                    if b == 0x00 or (b == 0xFF and g.short_address is None) or (b & 0x01 and g.short_address == (b >> 1) & 0x3F):
+                        g.initialising = True
+                        g.withdrawn = False
+        elif a == DaliCommand.Randomise:
+            if repeat == 2:
+                for g in self.gear:
+                    if g.initialising:
+                        g.random_address = g.rng.getrandbits(24)
+        elif a == DaliCommand.Compare:
+            return [0xFF for g in self.gear if g.initialising and not g.withdrawn and g.random_address <= self.search_address]
+        elif a == DaliCommand.Withdraw:
+            for g in self.searched():
+                g.withdrawn = True
+        elif a == DaliCommand.SearchAddrH:
+            self.search_address = (self.search_address & 0x00FFFF) | b << 16
+        elif a == DaliCommand.SearchAddrM:
+            self.search_address = (self.search_address & 0xFF00FF) | b << 8
+        elif a == DaliCommand.SearchAddrL:
+            self.search_address = (self.search_address & 0xFFFF00) | b
+        elif a == DaliCommand.ProgramShortAddress:
+            for g in self.searched():
+                g.short_address = None if b == 0xFF else (b >> 1) & 0x3F
+        elif a == DaliCommand.VerifyShortAddress:
+            return [0xFF for g in self.gear if g.initialising and g.short_address == (b >> 1) & 0x3F]
+        elif a == DaliCommand.QueryShortAddress:
+            return [0xFF if g.short_address is None else g.short_address << 1 | 0x01 for g in self.searched()]
+        return []
+
+    def transmit(self, cmd, type=DaliCommand.TYPE_16BIT, repeat=1):
+        """Puts a forward frame on the bus, returning the answer (NO_REPLY, FRAMING_ERROR or a byte)"""
+        frame = (cmd, type)
+        doubled = repeat == 2 or frame == self.last_frame
+        self.last_frame = None if doubled else frame
+        self.frames += repeat
+
+        answers = []
+        query = False
+        if type == DaliCommand.TYPE_16BIT:
+            a = (cmd >> 8) & 0xFF
+            b = cmd & 0xFF
+            if a & 0x80 == 0 or a >= 0xFC or a & 0xE0 == 0x80:
+                for g in self.addressed(a):
+                    if a & 0x01 == 0:
+                        if b != 0xFF:
+                            g.set_level(b)
+                    elif b in CONFIG_COMMANDS and not doubled:
+                        continue
+                    else:
+                        answer = g.command(b)
+                        if answer is not NO_REPLY:
+                            answers.append(answer)
+                query = a & 0x01 == 1 and b >= DaliCommand.QueryStatus
+            else:
+                answers = self.special(a, b, 2 if doubled else 1)
+                query = a in (DaliCommand.Compare, DaliCommand.VerifyShortAddress, DaliCommand.QueryShortAddress)
+        elif type == DaliCommand.TYPE_DA24CONF and doubled:
+            if cmd == 0xFFFE1D:
+                self.quiescent = True
+            elif cmd == 0xFFFE1E:
+                self.quiescent = False
+
+        self.bus_time += timing.frame_time(type, repeat, query)
+        if len(answers) == 0:
+            return NO_REPLY
+        elif len(answers) > 1:
+            return FRAMING_ERROR
+        return answers[0]
+
+
+class FakeHidDevice:
+    """Stands in for the hid.Device of a TridonicDali, answering writes from a SimulatedBus.
+
+    Either pass it to TridonicDali.open(), in which case reports are read by the driver's read thread just like the real
+    stick, or call attach(driver), which delivers reports straight to the driver on its event loop without a thread.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.reports = queue.Queue()
+        self.driver = None
+        self.closed = False
+
+    def attach(self, driver):
+        self.driver = driver
+        driver.hid = self
+        return self
+
+    def report(self, ty, cm, sn):
+        data = bytearray(16)
+        data[0] = 0x12
+        data[1] = ty
+        data[5] = cm
+        data[8] = sn
+        return bytes(data)
+
+    def respond(self, data):
+        """Returns the reports the stick would send in response to the USB command in data"""
+        cmd = data[5] << 16 | data[6] << 8 | data[7]
+        type = TridonicDali.wire_types.get(data[3], DaliCommand.TYPE_DA24CONF)
+        answer = self.bus.transmit(cmd, type, 2 if data[2] == 0x20 else 1)
+        if answer is NO_REPLY:
+            return [self.report(0x71, 0, data[1])]
+        elif answer is FRAMING_ERROR:
+            return [self.report(0x77, 0, data[1])]
+        return [self.report(0x72, answer, data[1])]
+
+    def deliver(self, report, delay=0):
+        if self.driver is not None:
+            if delay:
+                self.driver.evt_loop.call_later(delay, self.driver.message_received, self.driver.parse_report(report))
+            else:
+                self.driver.evt_loop.call_soon(self.driver.message_received, self.driver.parse_report(report))
+        elif delay:
+            threading.Timer(delay, self.reports.put, [report]).start()
+        else:
+            self.reports.put(report)
+
+    def write(self, data):
+        if self.closed:
+            raise OSError("device closed")
+        for report in self.respond(data):
+            self.deliver(report)
+        return len(data)
+
+    def read(self, size, timeout=None):
+        if self.closed:
+            raise OSError("device closed")
+        try:
+            report = self.reports.get(timeout=None if timeout is None else timeout / 1000)
+        except queue.Empty:
+            return b""
+        if report is None:
+            raise OSError("device closed")
+        return report
+
+    def close(self):
+        # Like hid, closing the device makes a blocked read fail straight away
+        self.closed = True
+        self.reports.put(None)
+
+
+class FaultyHidDevice(FakeHidDevice):
+    """A FakeHidDevice that misbehaves at configurable rates (each the probability per frame written).
+
+    no_response: the frame gets through but the gear's answer is lost, so the stick reports no response
+    framing_error: the frame collides with another transmitter (not while the bus is quiescent)
+    reorder: the report is delayed by up to max_delay seconds, so it may arrive after later ones
+    external: an unsolicited frame from another controller or input device is reported as well (not while the bus is
+              quiescent)
+    anonymous: a "no response" is reported with sequence number 0, as the stick sometimes does
+
+    faults: counts of the faults injected, by name
+    """
+
+    def __init__(self, bus, no_response=0.0, framing_error=0.0, reorder=0.0, external=0.0, anonymous=0.0,
+                 max_delay=0.005, seed=None):
+        FakeHidDevice.__init__(self, bus)
+        self.rates = {
+            "no_response": no_response,
+            "framing_error": framing_error,
+            "reorder": reorder,
+            "external": external,
+            "anonymous": anonymous,
+        }
+        self.max_delay = max_delay
+        self.rng = random.Random(seed)
+        self.faults = {name: 0 for name in self.rates}
+
+    def inject(self, name):
+        if self.rates[name] and self.rng.random() < self.rates[name]:
+            self.faults[name] += 1
+            return True
+        return False
+
+    def external_report(self):
+        data = bytearray(16)
+        data[0] = 0x11
+        data[1] = 0x73
+        data[4] = self.rng.randrange(0, 0x80) << 1
+        data[5] = self.rng.randrange(0, 0x100)
+        return bytes(data)
+
+    def garbled(self, data):
+        """Accounts for a frame that took up the bus but had no effect"""
+        repeat = 2 if data[2] == 0x20 else 1
+        self.bus.frames += repeat
+        self.bus.bus_time += timing.frame_time(DaliCommand.TYPE_16BIT, repeat, True)
+
+    def write(self, data):
+        if self.closed:
+            raise OSError("device closed")
+        if not self.bus.quiescent and self.inject("framing_error"):
+            self.garbled(data)
+            reports = [self.report(0x77, 0, data[1])]
+        else:
+            reports = self.respond(data)
+            if self.inject("no_response"):
+                reports = [self.report(0x71, 0, data[1])]
+        if not self.bus.quiescent and self.inject("external"):
+            self.deliver(self.external_report())
+        if reports[0][1] == 0x71 and self.inject("anonymous"):
+            reports = [self.report(0x71, 0, 0)]
+        for report in reports:
+            self.deliver(report, self.rng.uniform(0, self.max_delay) if self.inject("reorder") else 0)
+        return len(data)
@@ -0,0 +1,55 @@
+"""
+DALI bus timing (IEC 62386-101), used to estimate how long a sequence of frames occupies the bus.
+
+The bus runs at 1200 baud, Manchester encoded.
+    Forward frame (16 bit): 1 start bit, 16 data bits, 2 stop bits = 19 bits
+    Forward frame (24 bit): 1 start bit, 24 data bits, 2 stop bits = 27 bits
+    Backward frame: 1 start bit, 8 data bits, 2 stop bits = 11 bits
+"""
+from .command import DaliCommand
+
+BIT_TIME = 1 / 1200
+
+FORWARD_16BIT = 19 * BIT_TIME
+FORWARD_24BIT = 27 * BIT_TIME
+BACKWARD = 11 * BIT_TIME
+
+# Gap between a forward frame and the backward frame answering it
+BACKWARD_SETTLING = (0.0055, 0.0105)
+
+# Gap a transmitter leaves after the previous frame before it starts a forward frame, by priority.  Frames that
+# have to be sent twice use the priority 1 window for the second frame.
+FORWARD_SETTLING = {
+    1: (0.0135, 0.0147),
+    2: (0.0149, 0.0162),
+    3: (0.0163, 0.0177),
+    4: (0.0179, 0.0193),
+    5: (0.0195, 0.0212),
+}
+
+# If a backward frame hasn't started by this time after the forward frame, there is no answer.
+NO_RESPONSE_TIMEOUT = 0.0129
+
+# Input devices leave quiescent mode by themselves this long after the last StartQuiescentMode (IEC 62386-103)
+QUIESCENT_TIMEOUT = 15 * 60
+
+
+def forward_frame_time(type=DaliCommand.TYPE_16BIT):
+    return FORWARD_16BIT if type == DaliCommand.TYPE_16BIT else FORWARD_24BIT
+
+
+def frame_time(type=DaliCommand.TYPE_16BIT, repeat=1, reply=False, priority=2):
+    """Returns the time (in seconds) that a transmission occupies the bus, including the settling time before it.
+
+    reply: True if the transmission is a query, which waits for a backward frame
+    """
+    low, high = FORWARD_SETTLING[priority]
+    t = (low + high) / 2 + forward_frame_time(type)
+    if repeat == 2:
+        low, high = FORWARD_SETTLING[1]
+        t += (low + high) / 2 + forward_frame_time(type)
+    if reply:
+        # A query that isn't answered still holds the bus for about as long, until NO_RESPONSE_TIMEOUT
+        low, high = BACKWARD_SETTLING
+        t += (low + high) / 2 + BACKWARD
+    return t
@@ -0,0 +1,274 @@
+import asyncio
+import mmap
+import os
+import struct
+import time
+from typing import NamedTuple
+from .command import DaliException
+from .tridonic import TridonicDali
+
+
+MAGIC = b"DALITRC\x01"
+
+KIND_SENT = 0x01
+KIND_RECEIVED = 0x02
+
+"""
+Each record is a fixed 16 bytes, so a trace file can be indexed (and binary searched) without parsing it.
+
+    ts ts ts ts ts ts ts ts ki p0 p1 p2 p3 p4 p5 p6
+
+    ts: time.monotonic_ns() at the moment the frame was seen, little endian
+    ki: kind (KIND_SENT or KIND_RECEIVED)
+    p*: payload
+        sent:     sn rp ty ec ad cm 00   (bytes 1, 2, 3, 5, 6, 7 of the USB report)
+        received: dr ty ad cm sn 00 00   (the tuple produced by TridonicDali.receive)
+"""
+_RECORD = struct.Struct("<QB7s")
+RECORD_SIZE = _RECORD.size
+
+class TraceRecord(NamedTuple):
+    timestamp: int
+    kind: int
+    payload: bytes
+
+    @property
+    def seq(self):
+        return self.payload[0] if self.kind == KIND_SENT else self.payload[4]
+
+    @property
+    def cmd(self):
+        """The 24 bit command word of a sent frame"""
+        return self.payload[3] << 16 | self.payload[4] << 8 | self.payload[5]
+
+    @property
+    def repeat(self):
+        return 2 if self.payload[1] == 0x20 else 1
+
+    @property
+    def type(self):
+        return TridonicDali.wire_types.get(self.payload[2])
+
+    @property
+    def message(self):
+        """The (dr, ty, ad, cm, sn) tuple of a received frame, as passed to TridonicDali.message_received"""
+        return tuple(self.payload[0:5])
+
+
+class TraceRecorder:
+    """Appends every frame sent and received by a driver to a compact binary trace file.
+
+    Records are collected in memory and written out in blocks, so recording costs a struct.pack per frame on the bus
+    path.  When the file grows past max_bytes it is rotated to path.1, path.2 ... path.<backups>.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, backups=3, buffer_size=64 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.buffer_size = buffer_size
+        self.buf = bytearray()
+        self.file = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def open(self):
+        self.file = open(self.path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    def attach(self, driver):
+        driver.recorder = self
+        return self
+
+    def record_sent(self, data):
+        self.buf += _RECORD.pack(time.monotonic_ns(), KIND_SENT, bytes((data[1], data[2], data[3], data[5], data[6], data[7], 0)))
+        if len(self.buf) >= self.buffer_size:
+            self.flush()
+
+    def record_received(self, message):
+        (dr, ty, ad, cm, sn) = message
+        self.buf += _RECORD.pack(time.monotonic_ns(), KIND_RECEIVED, bytes((dr, ty, ad, cm, sn, 0, 0)))
+        if len(self.buf) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.file is None or len(self.buf) == 0:
+            return
+        self.file.write(self.buf)
+        self.file.flush()
+        self.buf = bytearray()
+        if self.max_bytes and self.file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = "{}.{}".format(self.path, i)
+            if os.path.exists(src):
+                os.replace(src, "{}.{}".format(self.path, i + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self.file = None
+        self.open()
+
+
+class TraceReader:
+    """Memory maps a trace file, giving random access to its records without loading it."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.map = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def open(self):
+        self.file = open(self.path, "rb")
+        if self.file.read(len(MAGIC)) != MAGIC:
+            self.close()
+            raise DaliException("{} is not a DALI trace file".format(self.path))
+        if os.fstat(self.file.fileno()).st_size == len(MAGIC):
+            self.map = MAGIC  # An empty trace, which can't be memory mapped
+        else:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        # A partially written final record (e.g. from a crash) is ignored.
+        self.count = (len(self.map) - len(MAGIC)) // RECORD_SIZE
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError("trace record index out of range")
+        return TraceRecord._make(_RECORD.unpack_from(self.map, len(MAGIC) + index * RECORD_SIZE))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def timestamp(self, index):
+        return struct.unpack_from("<Q", self.map, len(MAGIC) + index * RECORD_SIZE)[0]
+
+    def find(self, timestamp):
+        """Returns the index of the first record at or after timestamp (a binary search, so cheap on very large traces)"""
+        low = 0
+        high = self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self.timestamp(mid) < timestamp:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def between(self, start, end):
+        """Yields all records with start <= timestamp < end"""
+        for i in range(self.find(start), self.count):
+            record = self[i]
+            if record.timestamp >= end:
+                break
+            yield record
+
+
+class ReplayDevice:
+    """Stands in for the HID device of a TridonicDali, answering each write with the frames that followed the same
+    write in a recorded trace.
+
+    Sequence numbers are remapped, so the driver under test does not need to allocate the same sequence numbers as the
+    one that was recorded.  Replay is only deterministic for code that sends the same frames in the same order as the
+    recorded run did; the first divergence raises a DaliException from the write.
+    """
+
+    def __init__(self, driver, reader):
+        self.driver = driver
+        self.reader = reader
+        self.pos = 0
+        self.seq_map = {0: 0}
+
+    def _deliver_received(self):
+        while self.pos < len(self.reader):
+            record = self.reader[self.pos]
+            if record.kind == KIND_SENT:
+                break
+            (dr, ty, ad, cm, sn) = record.message
+            if sn in self.seq_map:
+                self.driver.evt_loop.call_soon(self.driver.message_received, (dr, ty, ad, cm, self.seq_map[sn]))
+            # Otherwise it answers a command sent before the trace started, which nothing can be waiting for.
+            self.pos += 1
+
+    def write(self, data):
+        self._deliver_received()
+        if self.pos >= len(self.reader):
+            raise DaliException("Replay diverged: trace exhausted")
+        record = self.reader[self.pos]
+        cmd = data[5] << 16 | data[6] << 8 | data[7]
+        if record.cmd != cmd or record.payload[2] != data[3]:
+            raise DaliException("Replay diverged at record {}: sent 0x{:06x}, trace has 0x{:06x}".format(self.pos, cmd, record.cmd))
+        self.seq_map[record.seq] = data[1]
+        self.pos += 1
+        self._deliver_received()
+        return len(data)
+
+    def read(self, size, timeout=None):
+        if timeout:
+            time.sleep(timeout / 1000)
+        return b""
+
+    def close(self):
+        pass
+
+
+class TraceReplayer:
+    """Feeds a recorded trace back into a TridonicDali, without any hardware"""
+
+    def __init__(self, driver, reader):
+        self.driver = driver
+        self.reader = reader
+
+    def attach(self):
+        """Replaces the driver's device with one answering from the trace, so that _send can be exercised"""
+        self.driver.hid = ReplayDevice(self.driver, self.reader)
+        return self.driver.hid
+
+    async def replay_received(self, speed=None, start=0, end=None):
+        """Passes every received frame to message_received, as a monitor would have seen them.
+
+        speed: None to replay as quickly as possible, otherwise a multiplier of the recorded timing (1.0 = real time)
+        """
+        last = None
+        for record in self.reader.between(start, end if end is not None else 0xFFFFFFFFFFFFFFFF):
+            if record.kind != KIND_RECEIVED:
+                continue
+            if speed and last is not None:
+                await asyncio.sleep((record.timestamp - last) / 1e9 / speed)
+            last = record.timestamp
+            self.driver.message_received(record.message)
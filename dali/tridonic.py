@@ -3,15 +3,35 @@ import asyncio
 import hid
 import struct
 import threading
-from .driver import DaliDriver
-from .command import DaliCommand, FramingException
+import time
+from .driver import DaliDriver, exclusive_frame, start_detached
+from .command import DaliCommand, DaliException, FramingException
+from .retry import RetryPolicy, classify
+
+
+class DeviceLostException(DaliException):
+    """Thrown when the USB device goes away (e.g. is unplugged) while a command is in flight"""
+
 
 class TridonicDali(DaliDriver):
+    # What happens to commands in flight when the device is lost
+    INFLIGHT_FAIL = "fail"  # They fail with DeviceLostException
+    INFLIGHT_REQUEUE = "requeue"  # Those that are safe to repeat are sent again on reconnect, the rest fail
 
     def __init__(self, evt_loop = None) -> None:
         DaliDriver.__init__(self)
         self.next_sequence = 1
         self.hid = None
+        self.read_thread = None
+        self.read_loop_running = False
+        self.device_factory = None
+        self.connected = asyncio.Event()
+        self.reconnect_interval = 0.05  # Seconds between attempts to reopen a lost device
+        self.reconnect_timeout = 5.0  # How long a send (or a command kept in flight) waits for a lost device to come back
+        self.reconnect_deadline = None
+        self.report_timeout = 1.0  # How long the stick may take to report on every command written before it
+        self.inflight_policy = TridonicDali.INFLIGHT_REQUEUE
+        self.reconnect_listeners = []  # Coroutine functions called after the device has been reopened
         self.message_directions = dict()
         self.message_directions[0x11] = "external"
         self.message_directions[0x12] = "received"
@@ -25,6 +45,8 @@ class TridonicDali(DaliDriver):
         self.message_types[0x77] = "framing error"
 
         self.outstanding_commands = dict()
+        self.recorder = None  # Optional TraceRecorder, see trace.py
+        self.retry_policy = RetryPolicy()  # Set to None to never retransmit after a collision
 
         if evt_loop is None:
             self.evt_loop = asyncio.get_event_loop()
@@ -38,21 +60,33 @@ class TridonicDali(DaliDriver):
     def __exit__(self, exc_type, exc_value, exc_traceback):
         self.close()
 
-    def open(self):
+    def open(self, device=None, device_factory=None):
+        """Opens the Tridonic USB stick.
+
+        device: something that behaves like a hid.Device to use instead
+        device_factory: a function returning a newly opened device, used to open it and to reopen it if it is lost.
+                        If neither is given, the stick is opened with hid.
+        """
         vendor = 0x17b5
         product = 0x0020
-        self.hid =  hid.Device(vendor, product)
+        if device is None and device_factory is None:
+            device_factory = lambda: hid.Device(vendor, product)
+        self.device_factory = device_factory
+        self.hid = device if device is not None else device_factory()
+        self.connected.set()
         self.read_loop_running = True
         self.read_thread = threading.Thread(target = self.read_loop, daemon=True)
         self.read_thread.start()
 
     def message_received(self, args):
         (dr, ty, ad, cm, sn) = args
+        if self.recorder is not None:
+            self.recorder.record_received(args)
 
         processed = False
         if dr == 0x12:
             if sn != 0:
-                awaitable = self.outstanding_commands[sn]
+                awaitable = self.outstanding_commands.get(sn)
                 if awaitable is not None:
                     if ty == 0x72: # Completed
                         awaitable.resolve(cm)
@@ -65,12 +99,19 @@ class TridonicDali(DaliDriver):
                         processed = True
                     elif ty == 0x77:
                         awaitable.resolve(FramingException("Framing Error"))
+                        del self.outstanding_commands[sn]
                         processed = True
                     elif ty == 0x73: # Transmit completed
                         processed = True # Ignore tx complete for commands that we initiated.
-            elif ty == 0x71:
-                self.last_command.resolve(None)
+            elif ty == 0x71 and len(self.outstanding_commands) == 1:
+                # An unnumbered "no response" can only be matched when just one command is waiting
+                seq, awaitable = self.outstanding_commands.popitem()
+                awaitable.resolve(None)
                 processed = True
+            elif ty == 0x71 and self.outstanding_commands:
+                # It is for one of the commands waiting, but which can't be told yet.  The report is logged below.
+                self.evt_loop.call_later(self.report_timeout, self.match_unnumbered,
+                                         list(self.outstanding_commands.values()))
         
         if not processed:
             print("{} {} [{:02x}] cmd {} seq {}".format(
@@ -80,28 +121,148 @@ class TridonicDali(DaliDriver):
                 DaliCommand.cmd_names.get(cm, "0x{:02x}".format(cm)), 
                 sn))
 
+    def match_unnumbered(self, candidates):
+        """Called report_timeout after an unnumbered "no response" that could have been for any of candidates.  The
+        others have had their own reports by now, so if only one is still waiting it was that one's.  If several are,
+        they fail, as they will get no other report."""
+        if not self.connected.is_set() and self.read_loop_running:
+            return  # Commands kept in flight while the device is lost are dealt with by device_lost()
+        waiting = [a for a in candidates if self.outstanding_commands.get(a.seq) is a]
+        for awaitable in waiting:
+            del self.outstanding_commands[awaitable.seq]
+            if len(waiting) == 1:
+                awaitable.resolve(None)
+            else:
+                awaitable.resolve(DaliException("No report for command (an unnumbered report could have been for it)"))
+
     def read_loop(self):
         while self.read_loop_running:
-            ret = self.receive(1000)
+            try:
+                ret = self.receive(1000)
+            except DeviceLostException as ex:
+                if not self.read_loop_running:
+                    break
+                self.evt_loop.call_soon_threadsafe(self.device_lost, ex)
+                self.reconnect()
+                continue
             if ret is not None:
                 self.evt_loop.call_soon_threadsafe(self.message_received, ret)
 
+    def reconnect(self):
+        """Called on the read thread to reopen a lost device.  Returns once it is open again, or the driver is closed"""
+        device = self.hid
+        self.hid = None
+        try:
+            device.close()
+        except Exception:
+            pass
+        while self.read_loop_running and self.device_factory is not None:
+            time.sleep(self.reconnect_interval)
+            try:
+                self.hid = self.device_factory()
+            except Exception:
+                continue
+            self.evt_loop.call_soon_threadsafe(self.device_restored)
+            return
+        # Without a factory the device can't be reopened, so wait to be closed.
+        while self.read_loop_running:
+            time.sleep(self.reconnect_interval)
+
+    def device_lost(self, ex):
+        if not self.connected.is_set():
+            return
+        print("DALI device lost ({}), reconnecting".format(ex))
+        self.connected.clear()
+        for seq, awaitable in list(self.outstanding_commands.items()):
+            cmd = awaitable.data[5] << 16 | awaitable.data[6] << 8 | awaitable.data[7]
+            repeat = 2 if awaitable.data[2] == 0x20 else 1
+            requeue = self.inflight_policy == TridonicDali.INFLIGHT_REQUEUE and self.read_loop_running
+            if not requeue or not classify(cmd, awaitable.type, repeat)[1]:
+                awaitable.resolve(DeviceLostException("DALI device lost"))
+                del self.outstanding_commands[seq]
+        # Commands kept for sending again fail if the device doesn't come back in time (or can't, without a factory)
+        self.reconnect_deadline = self.evt_loop.call_later(
+            self.reconnect_timeout, self.fail_outstanding,
+            DeviceLostException("DALI device lost, and not reconnected within {}s".format(self.reconnect_timeout)))
+
+    def write_failed(self, ex):
+        """Called on the event loop when writing to the device fails"""
+        self.device_lost(ex)
+        if self.read_thread is not None and self.hid is not None:
+            # Make the read thread give up on the device too, so that it reopens it.
+            try:
+                self.hid.close()
+            except Exception:
+                pass
+
+    def fail_outstanding(self, ex):
+        self.reconnect_deadline = None
+        for awaitable in self.outstanding_commands.values():
+            awaitable.resolve(ex)
+        self.outstanding_commands.clear()
+
+    def device_restored(self):
+        if self.hid is None:
+            return
+        # The stick forgot anything it was sending when it went away, so send what's still waiting again.
+        for awaitable in list(self.outstanding_commands.values()):
+            try:
+                self.write_report(awaitable.data)
+            except Exception as ex:
+                self.write_failed(ex)
+                return
+        if self.reconnect_deadline is not None:
+            self.reconnect_deadline.cancel()
+            self.reconnect_deadline = None
+        self.connected.set()
+        for listener in self.reconnect_listeners:
+            start_detached(listener())
+
     def close(self):
         self.read_loop_running = False
-        self.hid.close()  # This will cause any active call to read to throw an exception.
+        self.connected.clear()
+        if self.hid is not None:
+            self.hid.close()  # This will cause any active call to read to throw an exception.
         if self.read_thread is not None:
             self.read_thread.join() # This could wait up to 100ms due to the timeout nature of the reading thread.
+            self.read_thread = None
         self.hid = None
+        if self.reconnect_deadline is not None:
+            self.reconnect_deadline.cancel()
+        self.fail_outstanding(DaliException("DALI device closed"))
 
 
     def get_seq(self):
-        newseq = self.next_sequence
-        self.next_sequence = self.next_sequence + 1  # Note: Not thread safe
-        if self.next_sequence > 255:
-            self.next_sequence = 1 # Sequence 0 is reserved for external entities
-        return newseq
+        """Allocates a sequence number that isn't in use by a command still in flight.  Called on the event loop, with
+        no await between allocating the number and adding the command to outstanding_commands."""
+        for i in range(255):
+            newseq = self.next_sequence
+            self.next_sequence = self.next_sequence + 1
+            if self.next_sequence > 255:
+                self.next_sequence = 1 # Sequence 0 is reserved for external entities
+            if newseq not in self.outstanding_commands:
+                return newseq
+        raise DaliException("No free sequence numbers (255 commands in flight)")
 
     async def _send(self, cmd: int, type=DaliCommand.TYPE_16BIT, repeat=1):
+        """Sends a frame and waits for its answer, retransmitting it if it collides (see retry.py).  Exclusive frames
+        sent outside a transaction wait for any transaction in progress (see DaliDriver.transaction())"""
+        if not self.in_transaction() and exclusive_frame(cmd, type):
+            async with self.transaction():
+                return await self._send(cmd, type, repeat)
+        attempt = 0
+        while True:
+            if self.retry_policy is not None:
+                self.retry_policy.count(classify(cmd, type, repeat)[0], "sent")
+            try:
+                return await self._transmit(cmd, type, repeat)
+            except FramingException:
+                if self.retry_policy is None or not self.retry_policy.should_retry(cmd, type, repeat, attempt):
+                    raise
+            attempt += 1
+            await asyncio.sleep(self.retry_policy.backoff(attempt))
+
+    async def _transmit(self, cmd: int, type=DaliCommand.TYPE_16BIT, repeat=1):
         """Data expected by DALI USB:
         dr sn rp ty ?? ec ad cm .. .. .. .. .. .. .. ..
         12 1d 00 03 00 00 ff 08 00 00 00 00 00 00 00 00
@@ -123,10 +284,8 @@ class TridonicDali(DaliDriver):
         12 01 20 06 00 ff fe 1d 00 00 00 00 00 00 00 00...
         """
 
-        seq = self.get_seq()
         data = bytearray(64) # Transmitted packets are 64 bytes wide, but most of them (all but the first 8) are 0x00
         data[0] = 0x12 # USB side command
-        data[1] = seq
         if repeat == 2:
             data[2] = 0x20
         if type == DaliCommand.TYPE_16BIT:
@@ -140,30 +299,54 @@ class TridonicDali(DaliDriver):
         data[5] = (cmd >> 16) & 0xFF
         data[6] = (cmd >> 8) & 0xFF
         data[7] = cmd & 0xFF
-        # print("SND {}".format(bytes(data)))
 
+        if self.hid is None and self.read_loop_running:
+            # The read thread has dropped the device, but device_lost() hasn't run yet
+            self.device_lost(DeviceLostException("DALI device lost"))
+        if not self.connected.is_set() and self.read_loop_running:
+            # The device has been lost, but may come back
+            try:
+                await asyncio.wait_for(self.connected.wait(), self.reconnect_timeout)
+            except asyncio.TimeoutError:
+                raise DeviceLostException("DALI device lost")
         if self.hid is None:
             raise Exception("Device not open")
-        self.hid.write(bytes(data))
 
+        seq = self.get_seq()
+        data[1] = seq
         awaitable = DaliCommand(seq, data, type)
         self.outstanding_commands[awaitable.seq] = awaitable
-        self.last_command = awaitable
+        try:
+            self.write_report(data)
+        except Exception as ex:
+            if not self.read_loop_running:
+                # Nothing will reopen a device set without open() (e.g. a trace replay), so fail now
+                del self.outstanding_commands[seq]
+                raise
+            # The command stays outstanding, and device_lost() decides whether it is sent again on reconnect.
+            self.write_failed(ex)
         return await awaitable.wait()
 
+    def write_report(self, data):
+        """Writes a report to the stick, recording it if it was written"""
+        self.hid.write(bytes(data))
+        if self.recorder is not None:
+            self.recorder.record_sent(data)
+
 
 
     async def read_memory(self, address, bank, offset, num):
-        await self.send_special_cmd(DaliCommand.SetDTR1, bank)  # Set memory bank
-        await self.send_special_cmd(DaliCommand.SetDTR0, offset)  # Set location 
+        async with self.transaction():
+            await self.send_special_cmd(DaliCommand.SetDTR1, bank)  # Set memory bank
+            await self.send_special_cmd(DaliCommand.SetDTR0, offset)  # Set location 
 
-        buf = bytearray()
+            buf = bytearray()
 
-        for i in range(num):
-            b =  await self.send_cmd(address, DaliCommand.ReadMemoryLocation)
-            if b is None:
-                raise Exception("got no response when querying memory")
-            buf.append(b)
+            for i in range(num):
+                b =  await self.send_cmd(address, DaliCommand.ReadMemoryLocation)
+                if b is None:
+                    raise Exception("got no response when querying memory")
+                buf.append(b)
         return bytes(buf)
 
 
@@ -174,11 +357,20 @@ class TridonicDali(DaliDriver):
         try:
             data = self.hid.read(16, timeout)
         except Exception as ex:
-            print("EXCEPTION READING: ", ex)
-            return None
+            raise DeviceLostException("Error reading from DALI device: {}".format(ex))
         if data is None or len(data) == 0:
             return None
+        return self.parse_report(data)
+
+    # Frame types (byte 3 of a report written to the stick, see _transmit)
+    wire_types = {
+        0x03: DaliCommand.TYPE_16BIT,
+        0x04: DaliCommand.TYPE_24BIT,
+        0x06: DaliCommand.TYPE_DA24CONF,
+    }
 
+    @staticmethod
+    def parse_report(data):
         """Raw data received from DALI USB:
         dr ty ?? ec ad cm st st sn .. .. .. .. .. .. ..
         11 73 00 00 ff 93 ff ff 00 00 00 00 00 00 00 00
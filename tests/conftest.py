@@ -0,0 +1,14 @@
+import asyncio
+import pytest
+from dali.simulator import FakeHidDevice
+from dali.tridonic import TridonicDali
+
+
+@pytest.fixture
+def connect():
+    """Returns a function that makes a TridonicDali talking to a SimulatedBus.  Call it with the event loop running."""
+    def connect(bus):
+        driver = TridonicDali(asyncio.get_running_loop())
+        FakeHidDevice(bus).attach(driver)
+        return driver
+    return connect
@@ -0,0 +1,72 @@
+import asyncio
+from dali.bus import DaliBus, Installation, addresses_in
+from dali.simulator import SimulatedBus
+
+
+def test_addresses_in():
+    assert list(addresses_in(0)) == []
+    assert list(addresses_in(1 << 63 | 1 << 5 | 1)) == [0, 5, 63]
+
+
+def test_group_index_follows_membership():
+    bus = DaliBus()
+    bus.add(1).groups = 0b101
+    bus.add(2).groups = 0b100
+    assert list(addresses_in(bus.in_group(2))) == [1, 2]
+    bus.gear(1).groups = 0b010
+    assert list(addresses_in(bus.in_group(0))) == []
+    assert list(addresses_in(bus.in_group(1))) == [1]
+    assert list(addresses_in(bus.in_group(2))) == [2]
+    bus.remove(2)
+    assert bus.in_group(2) == 0
+    assert len(bus) == 1
+
+
+def test_type_index_follows_device_type():
+    bus = DaliBus()
+    bus.add(1, device_type=6)
+    bus.add(2, device_type=6)
+    bus.gear(2).device_type = 8
+    assert list(addresses_in(bus.of_type(6))) == [1]
+    assert list(addresses_in(bus.of_type(8))) == [2]
+    bus.remove(1)
+    assert bus.of_type(6) == 0
+
+
+def test_0xff_is_a_value_not_unknown():
+    bus = DaliBus()
+    gear = bus.add(3, device_type=0xFF)  # Several device types
+    assert gear.device_type == 0xFF
+    assert list(addresses_in(bus.of_type(0xFF))) == [3]
+    gear.set_scene(2, 0xFF)  # Not in the scene
+    assert gear.scene(2) == 0xFF
+    assert gear.scene(1) is None
+    gear.level = 0xFF
+    assert gear.level == 0xFF
+    assert bus.add(4).level is None
+
+
+def test_unique_id_index_spans_installation():
+    installation = Installation()
+    first = installation.add_bus("first")
+    second = installation.add_bus("second")
+    first.add(1, unique_id="a")
+    second.add(1, unique_id="b")
+    assert installation.find("b") == second.gear(1)
+    assert first.find("b") is None
+    second.gear(1).unique_id = None
+    assert installation.find("b") is None
+
+
+def test_update_from_scan(connect):
+    async def main():
+        sim = SimulatedBus.with_gear(3, seed=1)
+        sim.gear[1].groups = 0b10
+        bus = DaliBus()
+        await connect(sim).scan_for_gear(lookup_product=False, bus=bus)
+        return bus
+    bus = asyncio.run(main())
+    assert len(bus) == 3
+    assert list(addresses_in(bus.of_type(6))) == [0, 1, 2]
+    assert list(addresses_in(bus.in_group(1))) == [1]
+    assert bus.gear(0).unique_id is not None
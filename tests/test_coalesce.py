@@ -0,0 +1,68 @@
+import asyncio
+from dali.coalesce import CommandCoalescer, target, overlaps
+from dali.command import DaliCommand
+from dali.driver import BROADCAST_ADDRESS, group_address
+from dali.simulator import SimulatedBus
+
+
+def test_overlaps():
+    assert overlaps(target(3), target(3))
+    assert not overlaps(target(3), target(4))
+    # Group membership isn't known, so groups and broadcasts overlap with everything
+    assert overlaps(target(group_address(2)), target(4))
+    assert overlaps(target(BROADCAST_ADDRESS), target(group_address(2)))
+
+
+def test_newer_level_replaces_queued_one(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(4, seed=1)
+        coalescer = CommandCoalescer(connect(bus))
+        coalescer.pause()
+        sends = [asyncio.ensure_future(coalescer.send_direct_arc_power(3, level)) for level in (10, 20, 30, 40)]
+        await asyncio.sleep(0)
+        coalescer.resume()
+        await asyncio.gather(*sends)
+        await coalescer.close()
+        return bus, coalescer
+    bus, coalescer = asyncio.run(main())
+    assert bus.frames == 1
+    assert bus.gear[3].level == 40
+    assert coalescer.coalesced == 3
+
+
+def test_no_replacement_across_overlapping_command(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(4, seed=1)
+        coalescer = CommandCoalescer(connect(bus))
+        coalescer.pause()
+        sends = [
+            asyncio.ensure_future(coalescer.send_direct_arc_power(3, 10)),
+            asyncio.ensure_future(coalescer.send_direct_arc_power(group_address(0), 50)),
+            asyncio.ensure_future(coalescer.send_direct_arc_power(3, 20)),
+            asyncio.ensure_future(coalescer.send_direct_arc_power(2, 60)),
+        ]
+        await asyncio.sleep(0)
+        coalescer.resume()
+        await asyncio.gather(*sends)
+        await coalescer.close()
+        return bus, coalescer
+    bus, coalescer = asyncio.run(main())
+    assert bus.frames == 4
+    assert coalescer.coalesced == 0
+    assert bus.gear[3].level == 20
+
+
+def test_relative_commands_are_not_replaced(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        coalescer = CommandCoalescer(connect(bus))
+        coalescer.pause()
+        sends = [asyncio.ensure_future(coalescer.send_cmd(0, DaliCommand.Up)) for i in range(3)]
+        await asyncio.sleep(0)
+        coalescer.resume()
+        await asyncio.gather(*sends)
+        await coalescer.close()
+        return bus, coalescer
+    bus, coalescer = asyncio.run(main())
+    assert bus.frames == 3
+    assert coalescer.coalesced == 0
@@ -0,0 +1,102 @@
+import asyncio
+from dali.config import ConfigTransaction, GearSettings
+from dali.driver import BROADCAST_ADDRESS, group_address
+from dali.simulator import SimulatedBus
+
+
+DEFAULTS = GearSettings(power_on_level=254, system_failure_level=254, min_level=1, max_level=254, fade_time=0,
+                        fade_rate=7)
+
+
+def test_broadcast_when_every_gear_needs_the_value():
+    current = {a: DEFAULTS for a in range(4)}
+    plan = ConfigTransaction(None, current, all_gear=range(4)).set(range(4), fade_time=3).plan()
+    assert plan == [(3, "fade_time", BROADCAST_ADDRESS, frozenset(range(4)))]
+
+
+def test_no_broadcast_without_knowing_every_gear():
+    current = {a: DEFAULTS for a in range(4)}
+    plan = ConfigTransaction(None, current).set(range(4), fade_time=3).plan()
+    assert [target for (value, setting, target, covered) in plan] == [0, 1, 2, 3]
+
+
+def test_gear_that_already_has_the_value_allows_broadcast():
+    current = {a: DEFAULTS for a in range(4)}
+    current[3] = DEFAULTS._replace(fade_time=3)
+    plan = ConfigTransaction(None, current, all_gear=range(4)).set(range(3), fade_time=3).plan()
+    assert [target for (value, setting, target, covered) in plan] == [BROADCAST_ADDRESS]
+
+
+def test_group_used_where_it_covers_the_gear():
+    current = {a: DEFAULTS for a in range(4)}
+    transaction = ConfigTransaction(None, current, groups={1: [0, 1], 2: [1, 3]}, all_gear=range(4))
+    plan = transaction.set([0, 1, 2], max_level=200).plan()
+    assert [target for (value, setting, target, covered) in plan] == [group_address(1), 2]
+
+
+def test_raised_minimum_waits_for_maximum():
+    current = {0: DEFAULTS._replace(max_level=100)}
+    plan = ConfigTransaction(None, current).set(0, min_level=150, max_level=200).plan()
+    assert [setting for (value, setting, target, covered) in plan] == ["max_level", "min_level"]
+
+
+def test_commit_shares_dtr0(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(2, seed=1)
+        transaction = ConfigTransaction(connect(bus), {a: DEFAULTS for a in range(2)})
+        transaction.set(0, fade_time=5, fade_rate=5).set(1, power_on_level=5)
+        return bus, await transaction.commit()
+    bus, frames = asyncio.run(main())
+    # One SetDTR0, then three configuration commands sent twice each
+    assert frames == 7
+    assert bus.frames == 7
+    assert (bus.gear[0].fade_time, bus.gear[0].fade_rate, bus.gear[1].power_on_level) == (5, 5, 5)
+
+
+def test_commit_reads_unknown_settings(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(2, seed=1)
+        bus.gear[1].fade_time = 4
+        transaction = ConfigTransaction(connect(bus), all_gear=range(2)).set(range(2), fade_time=4)
+        await transaction.commit()
+        return bus, transaction
+    bus, transaction = asyncio.run(main())
+    assert [g.fade_time for g in bus.gear] == [4, 4]
+    assert transaction.current[0].fade_time == 4
+
+
+def test_broadcast_reads_nothing(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(64, seed=1)
+        transaction = ConfigTransaction(connect(bus), all_gear=range(64)).set(range(64), fade_time=3)
+        return bus, await transaction.commit()
+    bus, frames = asyncio.run(main())
+    # One SetDTR0 and one broadcast SetFadeTime sent twice, and no queries
+    assert frames == 3
+    assert bus.frames == 3
+    assert all(g.fade_time == 3 for g in bus.gear)
+
+
+def test_reads_only_settings_written_to_single_gear(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(3, seed=1)
+        bus.gear[1].fade_time = 3
+        transaction = ConfigTransaction(connect(bus)).set([0, 1], fade_time=3)
+        return bus, await transaction.commit()
+    bus, frames = asyncio.run(main())
+    # A query to each gear, then SetDTR0 and SetFadeTime to gear 0 only
+    assert frames == 3
+    assert bus.frames == 5
+    assert [g.fade_time for g in bus.gear] == [3, 3, 0]
+
+
+def test_raised_minimum_waits_for_unknown_maximum(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(2, seed=1)
+        for gear in bus.gear:
+            gear.max_level = 100
+        transaction = ConfigTransaction(connect(bus), all_gear=range(2)).set(range(2), min_level=150, max_level=200)
+        await transaction.commit()
+        return bus
+    bus = asyncio.run(main())
+    assert [(g.min_level, g.max_level) for g in bus.gear] == [(150, 200), (150, 200)]
@@ -0,0 +1,53 @@
+import pytest
+from dali.curve import (arc_to_percent, percent_to_arc, arcs_to_percents, percents_to_arcs, level_at, levels_at,
+                        percents_at, step_levels, PERCENT_TO_ARC, FADE_TIMES, FADE_RATES)
+from dali.gear import Fade
+
+
+def test_curve_end_points():
+    assert arc_to_percent(0) == 0.0
+    assert arc_to_percent(1) == pytest.approx(0.1)
+    assert arc_to_percent(254) == pytest.approx(100.0)
+    assert percent_to_arc(0) == 0
+    assert percent_to_arc(-5) == 0
+    assert percent_to_arc(100) == 254
+    assert percent_to_arc(150) == 254
+
+
+def test_every_level_round_trips():
+    levels = list(range(255))
+    assert percents_to_arcs(arcs_to_percents(levels)) == levels
+
+
+def test_percent_table_matches_search():
+    assert all(PERCENT_TO_ARC[tenths] == percent_to_arc(tenths / 10 + 1e-9) for tenths in range(1, 1000))
+    assert PERCENT_TO_ARC == sorted(PERCENT_TO_ARC)
+
+
+def test_fade_tables():
+    assert FADE_TIMES[0] == 0.0
+    assert FADE_TIMES[1] == pytest.approx(0.707, abs=0.001)
+    assert FADE_TIMES[15] == pytest.approx(90.5, abs=0.1)
+    assert FADE_RATES[1] == pytest.approx(357.8, abs=0.1)
+    assert FADE_RATES[15] == pytest.approx(2.8, abs=0.1)
+
+
+def test_fade_is_linear_in_levels():
+    fade = Fade(time=4, rate=7)  # 2 seconds
+    assert level_at(100, 200, fade, 0) == 100
+    assert level_at(100, 200, fade, 1.0) == pytest.approx(150)
+    assert level_at(100, 200, fade, 5.0) == 200
+    # Fading up from off starts at the minimum level
+    assert level_at(0, 201, fade, 1.0, min_level=1) == pytest.approx(101)
+
+
+def test_batch_fades_with_times_per_gear():
+    fades = [Fade(4, 7), Fade(0, 7)]
+    assert levels_at([100, 100], [200, 200], fades, [1.0, 0.0]) == pytest.approx([150, 200])
+    assert percents_at([0], [254], [Fade(0, 7)], 0.0) == pytest.approx([100.0])
+
+
+def test_step_levels_clamp():
+    fades = [Fade(0, 7)] * 3  # 44.7 steps a second, so 8 whole steps in 200ms
+    assert step_levels([100, 250, 0], fades, up=True) == [108, 254, 0]
+    assert step_levels([100, 5, 0], fades, up=False, min_levels=[1, 3, 1]) == [92, 3, 0]
@@ -0,0 +1,30 @@
+import asyncio
+from dali.identity import survey, verify_identities
+from dali.simulator import SimulatedBus
+
+
+def test_gear_found_where_it_was(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(3, seed=1)
+        driver = connect(bus)
+        known = await survey(driver, range(3))
+        return known, await verify_identities(driver, known, probe_unknown=False)
+    known, report = asyncio.run(main())
+    assert report.addresses == {uid: address for uid, (address, fp) in known.items()}
+    assert report.moved == {} and report.new == [] and report.missing == []
+
+
+def test_shared_random_address_matches_one_gear(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(2, seed=1)
+        driver = connect(bus)
+        known = await survey(driver, range(2))
+        bus.gear[0].short_address = 5
+        bus.gear[1].short_address = 6
+        bus.gear[1].random_address = bus.gear[0].random_address
+        return known, await verify_identities(driver, known)
+    known, report = asyncio.run(main())
+    uids = {address: uid for uid, (address, fp) in known.items()}
+    # Gear 1 is told apart by its serial
+    assert report.addresses == {uids[0]: 5, uids[1]: 6}
+    assert report.new == [] and report.missing == []
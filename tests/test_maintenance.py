@@ -0,0 +1,91 @@
+import asyncio
+from dali.coalesce import CommandCoalescer
+from dali.command import DaliCommand, DaliException
+from dali.maintenance import MaintenanceWindow
+from dali.simulator import SimulatedBus
+
+
+def test_overlapping_windows_share_quiescent_mode(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        driver = connect(bus)
+        states = []
+        second_open = asyncio.Event()
+        first_closed = asyncio.Event()
+
+        async def first():
+            async with MaintenanceWindow(driver):
+                states.append(bus.quiescent)
+                await second_open.wait()
+            first_closed.set()
+
+        async def second():
+            async with MaintenanceWindow(driver):
+                second_open.set()
+                await first_closed.wait()
+                states.append(bus.quiescent)
+                states.append(driver.quiescent_refresher is not None)
+            states.append(bus.quiescent)
+
+        await asyncio.gather(first(), second())
+        return bus, driver, states
+    bus, driver, states = asyncio.run(main())
+    assert states == [True, True, True, False]
+    assert driver.maintenance_windows == 0
+    assert driver.quiescent_refresher is None
+    # One start and one stop, each sent twice
+    assert bus.frames == 4
+
+
+def test_already_quiescent_bus_left_alone(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        driver = connect(bus)
+        await driver.start_quiescent()
+        async with MaintenanceWindow(driver):
+            pass
+        return bus, driver
+    bus, driver = asyncio.run(main())
+    assert bus.quiescent and driver.quiescent
+    assert bus.frames == 2
+
+
+def test_refresher_survives_failure(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        driver = connect(bus)
+        start_quiescent = driver.start_quiescent
+        failures = []
+
+        async def flaky():
+            if not failures:
+                failures.append(1)
+                raise DaliException("collision")
+            await start_quiescent()
+        async with MaintenanceWindow(driver, refresh_interval=0.005) as window:
+            driver.start_quiescent = flaky
+            while window.refreshes < 2:
+                await asyncio.sleep(0.005)
+        return bus, driver, failures
+    bus, driver, failures = asyncio.run(main())
+    assert failures == [1]
+    assert not bus.quiescent and not driver.quiescent
+    assert driver.quiescent_refresher is None
+
+
+def test_interactive_commands_held_back(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        coalescer = CommandCoalescer(connect(bus))
+        levels = []
+        async with MaintenanceWindow(coalescer.driver, coalescer):
+            sends = [asyncio.ensure_future(coalescer.send_direct_arc_power(0, level)) for level in (10, 20, 30)]
+            await asyncio.sleep(0.01)
+            levels.append(bus.gear[0].level)
+        await asyncio.gather(*sends)
+        levels.append(bus.gear[0].level)
+        await coalescer.close()
+        return levels, coalescer
+    levels, coalescer = asyncio.run(main())
+    assert levels == [254, 30]
+    assert coalescer.coalesced == 2
@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+from dali.command import DaliException
+from dali.memory import MemoryBankReader, MemoryBankCache, UNANSWERED, BANK0_IDENTITY, unique_id
+from dali.simulator import FakeHidDevice, SimulatedBus, SimulatedGear
+
+
+def test_dali2_gear_without_location_0x01(connect):
+    async def main():
+        bus = SimulatedBus([SimulatedGear(0, unanswered=[(0, 0x01)]), SimulatedGear(1)])
+        reader = MemoryBankReader(connect(bus))
+        banks = await reader.read_banks([0, 1], 0)
+        ids = await MemoryBankCache(reader).identify([0, 1])
+        return bus, reader, banks, ids
+    bus, reader, banks, ids = asyncio.run(main())
+    assert banks[0][0x01] == UNANSWERED
+    assert banks[0][0x02:] == bytes(bus.gear[0].banks[0][0x02:])
+    assert not reader.answered(0, 0, 0x01)
+    assert reader.answered(1, 0, 0x01)
+    assert ids[0] != ids[1]
+
+
+def test_cache_load_matches_identify(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(3, seed=1)
+        cache = MemoryBankCache(MemoryBankReader(connect(bus)))
+        return bus, cache, await cache.load(range(3)), await cache.identify(range(3))
+    bus, cache, loaded, identified = asyncio.run(main())
+    assert loaded == identified
+    assert cache.bank(loaded[2], 0) == bytes(bus.gear[2].banks[0])
+
+
+class LossyHidDevice(FakeHidDevice):
+    """Reports no response to the writes numbered in lose (counting from 0).  If dropped, the frame never reached the
+    bus; otherwise only the answer was lost."""
+
+    def __init__(self, bus, lose, dropped):
+        FakeHidDevice.__init__(self, bus)
+        self.lose = set(lose)
+        self.dropped = dropped
+        self.writes = 0
+
+    def respond(self, data):
+        self.writes += 1
+        if self.writes - 1 not in self.lose:
+            return FakeHidDevice.respond(self, data)
+        if not self.dropped:
+            FakeHidDevice.respond(self, data)
+        return [self.report(0x71, 0, data[1])]
+
+
+def test_dropped_frame_read_again(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        driver = connect(bus)
+        LossyHidDevice(bus, lose=[2 + 3], dropped=True).attach(driver)  # The 4th ReadMemoryLocation
+        cache = MemoryBankCache(MemoryBankReader(driver))
+        return bus, cache, await cache.load([0])
+    bus, cache, ids = asyncio.run(main())
+    assert ids[0] == unique_id(bus.gear[0].banks[0][BANK0_IDENTITY:])
+    assert cache.bank(ids[0], 0) == bytes(bus.gear[0].banks[0])
+
+
+def test_lost_answer_fails_read(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        driver = connect(bus)
+        LossyHidDevice(bus, lose=[2 + 3], dropped=False).attach(driver)
+        reader = MemoryBankReader(driver)
+        with pytest.raises(DaliException):
+            await reader.read(0, 0, 0, 8)
+        # DTR0 is set again for the next read
+        return bus, await reader.read(0, 0, 0, 8)
+    bus, data = asyncio.run(main())
+    assert data == bytes(bus.gear[0].banks[0][:8])
@@ -0,0 +1,41 @@
+import asyncio
+import pstats
+from dali.profiling import Profiler
+from dali.simulator import SimulatedBus
+
+
+def test_commission_phases(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(3, addressed=False, seed=1)
+        driver = connect(bus)
+        profiler = Profiler(python_profile=True, simulated=True).attach(driver)
+        with profiler.phase("commission"):
+            assigned = await driver.commission()
+        return bus, assigned, profiler
+    bus, assigned, profiler = asyncio.run(main())
+    report = profiler.report()
+    assert sorted(assigned.values()) == [0, 1, 2]
+    phases = report["phases"]
+    steps = ["commission: initialise", "commission: search", "commission: program address"]
+    assert all(phases[step] > 0 for step in steps)
+    assert sum(phases[step] for step in steps) <= phases["commission"]
+    assert report["frames"] == bus.frames
+    assert report["bus_utilisation"] is None
+    # The Python profile covers the whole of the outer phase, not just up to the end of the first inner one
+    functions = [name for (filename, line, name) in pstats.Stats(profiler.profile).stats]
+    assert "search_for_device" in functions
+
+
+def after_inner_phase():
+    pass
+
+
+def test_python_profile_covers_nested_phases():
+    profiler = Profiler()
+    with profiler.phase("outer"):
+        with profiler.phase("inner"):
+            pass
+        after_inner_phase()
+    functions = [name for (filename, line, name) in pstats.Stats(profiler.profile).stats]
+    assert "after_inner_phase" in functions
+    assert profiler.phases["inner"] <= profiler.phases["outer"]
@@ -0,0 +1,117 @@
+import asyncio
+import time
+import pytest
+from dali.command import DaliCommand
+from dali.simulator import FakeHidDevice, SimulatedBus
+from dali.tridonic import TridonicDali, DeviceLostException
+
+
+class HoldingHidDevice(FakeHidDevice):
+    """A FakeHidDevice that never answers, as if the stick were still sending when it is unplugged"""
+
+    def write(self, data):
+        if self.closed:
+            raise OSError("device closed")
+        return len(data)
+
+
+class Recorder:
+    def __init__(self):
+        self.sent = []
+
+    def record_sent(self, data):
+        self.sent.append(data[5] << 16 | data[6] << 8 | data[7])
+
+    def record_received(self, message):
+        pass
+
+
+def open_driver(bus, *devices):
+    """Opens a driver on the first of devices, with each of the rest returned by one reconnection attempt"""
+    driver = TridonicDali(asyncio.get_running_loop())
+    driver.reconnect_interval = 0.01
+    devices = list(devices)
+    driver.open(device_factory=lambda: devices.pop(0))
+    return driver
+
+
+def test_requeue_repeatable_commands():
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        lost = HoldingHidDevice(bus)
+        driver = open_driver(bus, lost, FakeHidDevice(bus))
+        driver.recorder = Recorder()
+        query = asyncio.ensure_future(driver.send_cmd(0, DaliCommand.QueryActualLevel))
+        read = asyncio.ensure_future(driver.send_cmd(0, DaliCommand.ReadMemoryLocation))
+        await asyncio.sleep(0.01)
+        lost.close()
+        level = await query
+        # ReadMemoryLocation moves DTR0 on, so may not be sent again
+        with pytest.raises(DeviceLostException):
+            await read
+        after = await driver.send_cmd(0, DaliCommand.QueryActualLevel)
+        driver.close()
+        return level, after, driver.recorder.sent
+    level, after, sent = asyncio.run(main())
+    assert (level, after) == (254, 254)
+    query = 0x01 << 8 | DaliCommand.QueryActualLevel
+    read = 0x01 << 8 | DaliCommand.ReadMemoryLocation
+    # The frame sent again on reconnect is recorded like any other
+    assert sent == [query, read, query, query]
+
+
+def test_fail_policy():
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        lost = HoldingHidDevice(bus)
+        driver = open_driver(bus, lost, FakeHidDevice(bus))
+        driver.inflight_policy = TridonicDali.INFLIGHT_FAIL
+        query = asyncio.ensure_future(driver.send_cmd(0, DaliCommand.QueryActualLevel))
+        await asyncio.sleep(0.01)
+        lost.close()
+        with pytest.raises(DeviceLostException):
+            await query
+        after = await driver.send_cmd(0, DaliCommand.QueryActualLevel)
+        driver.close()
+        return after
+    assert asyncio.run(main()) == 254
+
+
+def test_gives_up_after_reconnect_timeout():
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        lost = HoldingHidDevice(bus)
+        driver = open_driver(bus, lost)  # Never comes back
+        driver.reconnect_timeout = 0.1
+        query = asyncio.ensure_future(driver.send_cmd(0, DaliCommand.QueryActualLevel))
+        await asyncio.sleep(0.01)
+        lost.close()
+        start = time.monotonic()
+        with pytest.raises(DeviceLostException):
+            await query
+        waited = time.monotonic() - start
+        with pytest.raises(DeviceLostException):
+            await driver.send_cmd(0, DaliCommand.QueryActualLevel)
+        driver.close()
+        return waited, driver.outstanding_commands
+    waited, outstanding = asyncio.run(main())
+    assert 0.05 < waited < 1.0
+    assert outstanding == {}
+
+
+def test_send_waits_while_read_thread_drops_device():
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        driver = TridonicDali(asyncio.get_running_loop())
+        # The read thread has dropped the device, and device_lost() hasn't run on the event loop yet
+        driver.read_loop_running = True
+        driver.connected.set()
+        query = asyncio.ensure_future(driver.send_cmd(0, DaliCommand.QueryActualLevel))
+        await asyncio.sleep(0.01)
+        assert not query.done()
+        FakeHidDevice(bus).attach(driver)
+        driver.device_restored()
+        level = await query
+        driver.read_loop_running = False
+        return level
+    assert asyncio.run(main()) == 254
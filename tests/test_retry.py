@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+from dali.command import DaliCommand, FramingException
+from dali.retry import classify
+from dali.simulator import FakeHidDevice, SimulatedBus
+
+
+class CollidingHidDevice(FakeHidDevice):
+    """Delivers each frame to the bus, but reports a framing error instead of the answer to the writes numbered in
+    collide (counting from 0)"""
+
+    def __init__(self, bus, collide):
+        FakeHidDevice.__init__(self, bus)
+        self.collide = set(collide)
+        self.writes = 0
+
+    def respond(self, data):
+        reports = FakeHidDevice.respond(self, data)
+        self.writes += 1
+        if self.writes - 1 in self.collide:
+            return [self.report(0x77, 0, data[1])]
+        return reports
+
+
+def test_classify():
+    assert classify(0x06FE) == ("arc", True, False)
+    assert classify(0x012E, repeat=2) == ("config", True, False)
+    assert classify(0x012E) == ("config", False, False)
+    assert classify(0xFFA0) == ("query", True, True)
+    assert classify(0x01A0) == ("query", True, False)
+    assert classify(DaliCommand.SetDTR0 << 8) == ("special", True, False)
+
+
+def test_search_commands_take_many_answers():
+    for cmd in (DaliCommand.Compare, DaliCommand.QueryShortAddress, DaliCommand.VerifyShortAddress):
+        assert classify(cmd << 8) == ("special", False, True)
+
+
+def test_dtr0_advancing_commands_not_repeated():
+    assert classify(0x01 << 8 | DaliCommand.ReadMemoryLocation) == ("query", False, False)
+    assert classify(DaliCommand.WriteMemoryLocation << 8 | 0x55) == ("special", False, False)
+    assert classify(DaliCommand.WriteMemoryLocationNoReply << 8 | 0x55) == ("special", False, False)
+
+
+def test_collided_memory_read_fails(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        driver = connect(bus)
+        CollidingHidDevice(bus, collide=[2 + 3]).attach(driver)  # The 4th ReadMemoryLocation, after SetDTR1 and SetDTR0
+        with pytest.raises(FramingException):
+            await driver.read_memory(0, 0, 0, 8)
+        return bus, await driver.read_memory(0, 0, 0, 8)
+    bus, data = asyncio.run(main())
+    assert data == bytes(bus.gear[0].banks[0][:8])
+
+
+def test_collided_query_repeated(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        driver = connect(bus)
+        CollidingHidDevice(bus, collide=[0]).attach(driver)
+        return await driver.send_cmd(0, DaliCommand.QueryActualLevel), driver.retry_policy.stats["query"]
+    level, stats = asyncio.run(main())
+    assert level == 254
+    assert stats == {"sent": 2, "collisions": 1, "retries": 1, "failures": 0}
@@ -0,0 +1,100 @@
+import asyncio
+from dali.coalesce import CommandCoalescer
+from dali.command import DaliCommand, DaliException
+from dali.simulator import FakeHidDevice, SimulatedBus
+from dali.tridonic import TridonicDali
+
+
+def test_worker_started_in_transaction_is_not_part_of_later_ones(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        driver = connect(bus)
+        coalescer = CommandCoalescer(driver)
+        async with driver.transaction():
+            await coalescer.send_cmd(0, DaliCommand.QueryActualLevel)
+
+        async def set_fade_time():
+            async with driver.transaction():
+                await driver.send_special_cmd(DaliCommand.SetDTR0, 5)
+                await asyncio.sleep(0.01)
+                await driver.send_cmd(0, DaliCommand.SetFadeTime, repeat=2)
+        other = asyncio.ensure_future(set_fade_time())
+        await asyncio.sleep(0.001)
+        await coalescer.send_special_cmd(DaliCommand.SetDTR0, 9)
+        await other
+        await coalescer.close()
+        return bus
+    assert asyncio.run(main()).gear[0].fade_time == 5
+
+
+def test_use_within_transaction_does_not_deadlock(connect):
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        driver = connect(bus)
+        coalescer = CommandCoalescer(driver).start()
+        async with driver.transaction():
+            await asyncio.wait_for(coalescer.send_special_cmd(DaliCommand.SetDTR0, 3), 1)
+            dtr0 = await coalescer.send_cmd(0, DaliCommand.QueryContentDTR0)
+        await coalescer.close()
+        return dtr0
+    assert asyncio.run(main()) == 3
+
+
+class SilentHidDevice(FakeHidDevice):
+    """Passes frames to the bus, leaving the reports to the test"""
+
+    def write(self, data):
+        self.bus.transmit(data[5] << 16 | data[6] << 8 | data[7], DaliCommand.TYPE_16BIT)
+        return len(data)
+
+
+def in_flight(driver, count):
+    return [asyncio.ensure_future(driver.send_cmd(0, DaliCommand.QueryActualLevel)) for i in range(count)]
+
+
+def test_unnumbered_report_matched_by_elimination():
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        driver = TridonicDali(asyncio.get_running_loop())
+        SilentHidDevice(bus).attach(driver)
+        driver.report_timeout = 0.02
+        sends = in_flight(driver, 2)
+        await asyncio.sleep(0)
+        second = max(driver.outstanding_commands)
+        driver.message_received((0x12, 0x71, 0, 0, 0))
+        driver.message_received((0x12, 0x72, 0, 200, second))
+        await asyncio.sleep(0.01)
+        assert not sends[0].done()  # It can't be told which command the report was for until the timeout
+        return await asyncio.gather(*sends), driver.outstanding_commands
+    answers, outstanding = asyncio.run(main())
+    assert answers == [None, 200]
+    assert outstanding == {}
+
+
+def test_unnumbered_report_for_one_of_several_fails_them():
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        driver = TridonicDali(asyncio.get_running_loop())
+        SilentHidDevice(bus).attach(driver)
+        driver.report_timeout = 0.02
+        sends = in_flight(driver, 3)
+        await asyncio.sleep(0)
+        driver.message_received((0x12, 0x71, 0, 0, 0))
+        driver.message_received((0x12, 0x72, 0, 200, max(driver.outstanding_commands)))
+        return await asyncio.gather(*sends, return_exceptions=True), driver.outstanding_commands
+    answers, outstanding = asyncio.run(main())
+    assert isinstance(answers[0], DaliException) and isinstance(answers[1], DaliException)
+    assert answers[2] == 200
+    assert outstanding == {}
+
+
+def test_unnumbered_report_for_only_command():
+    async def main():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        driver = TridonicDali(asyncio.get_running_loop())
+        SilentHidDevice(bus).attach(driver)
+        send = in_flight(driver, 1)[0]
+        await asyncio.sleep(0)
+        driver.message_received((0x12, 0x71, 0, 0, 0))
+        return await asyncio.wait_for(send, 0.01)
+    assert asyncio.run(main()) is None
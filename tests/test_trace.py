@@ -0,0 +1,90 @@
+import asyncio
+import os
+import pytest
+from dali.command import DaliCommand, DaliException
+from dali.gear import DaliGear
+from dali.simulator import SimulatedBus
+from dali.trace import TraceReader, TraceRecorder, TraceReplayer, MAGIC, RECORD_SIZE
+from dali.tridonic import TridonicDali
+
+
+def test_header_required(tmp_path):
+    for contents in (b"", MAGIC[:4], b"not a trace file"):
+        path = tmp_path / "trace"
+        path.write_bytes(contents)
+        with pytest.raises(DaliException):
+            TraceReader(str(path)).open()
+
+
+def test_empty_trace(tmp_path):
+    path = tmp_path / "trace"
+    path.write_bytes(MAGIC)
+    with TraceReader(str(path)) as reader:
+        assert len(reader) == 0
+        assert list(reader) == []
+
+
+def test_records_read_back(tmp_path):
+    path = str(tmp_path / "trace")
+    with TraceRecorder(path) as recorder:
+        recorder.record_sent(bytes([0x12, 0x01, 0x00, 0x03, 0x00, 0x00, 0x01, 0xA0]))
+        recorder.record_received((0x11, 0x72, 0x00, 0xFE, 0x01))
+    with TraceReader(path) as reader:
+        assert len(reader) == 2
+        assert reader[0].seq == 1
+
+
+def test_replay_matches_recording(tmp_path, connect):
+    path = str(tmp_path / "trace")
+
+    async def record():
+        bus = SimulatedBus.with_gear(1, seed=1)
+        bus.gear[0].groups = 0x0102
+        driver = connect(bus)
+        with TraceRecorder(path).attach(driver):
+            gear = DaliGear(driver, 0)
+            await gear.fetch_deviceinfo(lookup_product=False)
+        return gear
+
+    async def replay():
+        driver = TridonicDali(asyncio.get_running_loop())
+        driver.next_sequence = 100  # Sequence numbers needn't match the recording
+        with TraceReader(path) as reader:
+            TraceReplayer(driver, reader).attach()
+            gear = DaliGear(driver, 0)
+            await gear.fetch_deviceinfo(lookup_product=False)
+            with pytest.raises(DaliException):
+                await driver.send_cmd(0, DaliCommand.QueryActualLevel)  # The trace has run out
+        return gear
+    recorded = asyncio.run(record())
+    replayed = asyncio.run(replay())
+    assert replayed.info == recorded.info
+    assert (replayed.groups, replayed.min_level, replayed.max_level, replayed.level) == (0x0102, 1, 254, 254)
+
+
+def test_replay_detects_divergence(tmp_path, connect):
+    path = str(tmp_path / "trace")
+
+    async def main():
+        driver = connect(SimulatedBus.with_gear(1, seed=1))
+        with TraceRecorder(path).attach(driver):
+            await driver.send_cmd(0, DaliCommand.QueryActualLevel)
+        driver = TridonicDali(asyncio.get_running_loop())
+        with TraceReader(path) as reader:
+            TraceReplayer(driver, reader).attach()
+            with pytest.raises(DaliException):
+                await driver.send_cmd(0, DaliCommand.QueryMaxLevel)
+    asyncio.run(main())
+
+
+def test_rotation(tmp_path):
+    path = str(tmp_path / "trace")
+    frame = bytes([0x12, 0x01, 0x00, 0x03, 0x00, 0x00, 0x01, 0xA0])
+    with TraceRecorder(path, max_bytes=len(MAGIC) + 4 * RECORD_SIZE, backups=2, buffer_size=1) as recorder:
+        for i in range(14):
+            recorder.record_sent(frame)
+    # Rotated after every 4 records, with the oldest dropped
+    assert sorted(os.listdir(str(tmp_path))) == ["trace", "trace.1", "trace.2"]
+    for name, count in (("trace", 2), ("trace.1", 4), ("trace.2", 4)):
+        with TraceReader(str(tmp_path / name)) as reader:
+            assert len(reader) == count